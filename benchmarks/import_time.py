@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+#
+# Copyright 2014 Kontron Europe GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Times a cold `import HpiLibrary` and a libdoc run of the library.
+
+Each measurement runs in a fresh interpreter, so no module is cached.
+The import is also checked for loading pyhpi, which should only happen
+when a keyword needs it. For comparison, the import is timed once more
+together with all modules the library loads on first use, which is what
+it would cost if they were imported eagerly.
+
+Usage: python benchmarks/import_time.py [runs]
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+SRC = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+IMPORT_SCRIPT = '''
+import sys, time
+start_time = time.time()
+import HpiLibrary
+if sys.argv[1] == 'eager':
+    for value in vars(HpiLibrary).values():
+        if isinstance(value, HpiLibrary.LazyModule):
+            __import__(value._name)
+print time.time() - start_time, 'pyhpi' in sys.modules
+'''
+
+def _environment():
+    env = dict(os.environ)
+    paths = [SRC] + [p for p in env.get('PYTHONPATH', '').split(os.pathsep)
+            if p]
+    env['PYTHONPATH'] = os.pathsep.join(paths)
+    return env
+
+def time_import(env, mode='lazy'):
+    output = subprocess.check_output([sys.executable, '-c', IMPORT_SCRIPT,
+            mode], env=env)
+    elapsed, pyhpi_loaded = output.split()
+    return float(elapsed), pyhpi_loaded == 'True'
+
+def time_libdoc(env, output):
+    start_time = time.time()
+    subprocess.check_call([sys.executable, '-m', 'robot.libdoc',
+            'HpiLibrary', output], env=env, stdout=open(os.devnull, 'wb'))
+    return time.time() - start_time
+
+def _summary(samples):
+    samples = sorted(samples)
+    return 'min %.1f ms, median %.1f ms' % (samples[0] * 1e3,
+            samples[len(samples) // 2] * 1e3)
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    env = _environment()
+    imports = [time_import(env) for _ in range(runs)]
+    print 'import HpiLibrary: %s' % _summary([i[0] for i in imports])
+    print '  pyhpi imported: %s' % any(i[1] for i in imports)
+    eager = [time_import(env, 'eager')[0] for _ in range(runs)]
+    print 'import HpiLibrary with deferred modules: %s' % _summary(eager)
+
+    fd, output = tempfile.mkstemp(suffix='.html')
+    os.close(fd)
+    try:
+        libdocs = [time_libdoc(env, output) for _ in range(runs)]
+    finally:
+        os.remove(output)
+    print 'libdoc HpiLibrary: %s' % _summary(libdocs)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+#
+# Copyright 2014 Kontron Europe GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measures the library against simulated sessions of growing size.
+
+For each number of RDRs, the latency of common keywords and the number of
+daemon calls they make are measured, once with a cold inventory cache and
+then repeated with a warm one. The reaction time of the `Wait Until`
+keywords is the time between the simulated state change and the return
+of the keyword. It includes the time needed to start the operation, so it
+is an upper bound.
+
+Usage: python benchmarks/keywords.py [--sizes 10,100,1000,10000]
+           [--repeat 100] [--latency 0] [--phase-time 0.2]
+"""
+
+import optparse
+import os
+import sys
+import time
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from HpiLibrary.simulator import SimulatedHpiLibrary
+
+RDRS_PER_RESOURCE = 100
+
+KEYWORDS = (
+    ('Set Entity Path', 'set_entity_path', None),
+    ('Select FUMI RDR', 'select_fumi_rdr', ('FUMI',)),
+    ('Select Bank Number', 'select_bank_number', (1,)),
+    ('Size Of Selected Bank Should Be', 'size_of_selected_bank_should_be',
+        (1024 * 1024,)),
+    ('Upgrade State Should Be', 'upgrade_state_should_be',
+        ('OPERATION_NOTSTARTED',)),
+    ('Select DIMI RDR', 'select_dimi_rdr', ('DIMI',)),
+    ('Select Test', 'select_test', (1,)),
+    ('Test Status Should Be', 'test_status_should_be', ('NOT_RUN',)),
+)
+
+class _Quiet:
+    """Drops the log messages the library prints outside of Robot
+    Framework."""
+
+    def __enter__(self):
+        self._stdout, sys.stdout = sys.stdout, StringIO()
+
+    def __exit__(self, *exc_info):
+        sys.stdout = self._stdout
+
+
+def _call_count(lib):
+    return sum(lib.get_simulated_call_counts(reset=True).values())
+
+def _run_keywords(lib, ep, repeat):
+    """Returns `(name, cold latency, cold calls, warm latency, warm calls)`
+    per keyword."""
+    rows = []
+    lib.invalidate_inventory_cache()
+    _call_count(lib)
+    for name, method, args in KEYWORDS:
+        func = getattr(lib, method)
+        if args is None:
+            args = (ep,)
+        start_time = time.time()
+        func(*args)
+        cold = time.time() - start_time
+        cold_calls = _call_count(lib)
+        start_time = time.time()
+        for _ in xrange(repeat):
+            func(*args)
+        warm = (time.time() - start_time) / repeat
+        warm_calls = float(_call_count(lib)) / repeat
+        rows.append((name, cold, cold_calls, warm, warm_calls))
+    return rows
+
+def _reaction_times(lib, ep, phase_time, repeat):
+    """Returns the worst reaction time of the upgrade state and the test
+    status waits."""
+    fumi = []
+    dimi = []
+    lib.set_entity_path(ep)
+    lib.select_fumi_rdr('FUMI')
+    lib.select_bank_number(1)
+    lib.select_dimi_rdr('DIMI')
+    lib.select_test(1)
+    for _ in range(repeat):
+        lib.select_fumi_rdr('FUMI')
+        lib.select_bank_number(1)
+        start_time = time.time()
+        lib.start_installation()
+        lib.wait_until_upgrade_state_is('INSTALL_DONE')
+        fumi.append(time.time() - start_time - phase_time)
+        lib.cleanup()
+        lib.select_dimi_rdr('DIMI')
+        lib.select_test(1)
+        start_time = time.time()
+        lib.start_test()
+        lib.wait_until_test_status_is('FINISHED_NO_ERRORS')
+        dimi.append(time.time() - start_time - phase_time)
+    return max(fumi), max(dimi)
+
+def benchmark(rdrs, options):
+    resources = max(1, rdrs // RDRS_PER_RESOURCE)
+    lib = SimulatedHpiLibrary(timeout=10 + 2 * options.phase_time,
+            poll_interval=1)
+    lib.open_simulated_hpi_connection(resources, rdrs // resources,
+            options.latency, options.phase_time, options.phase_time)
+    # The last resource, so lookups cover the whole RPT table.
+    ep = '{SYSTEM_CHASSIS,1}{PHYSICAL_SLOT,%d}' % resources
+    try:
+        rows = _run_keywords(lib, ep, options.repeat)
+        reactions = _reaction_times(lib, ep, options.phase_time,
+                options.reactions)
+    finally:
+        lib.close_all_hpi_connections()
+    return rows, reactions
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--sizes', default='10,100,1000,10000',
+            help='comma separated numbers of RDRs [%default]')
+    parser.add_option('--repeat', type='int', default=100,
+            help='calls per keyword with a warm cache [%default]')
+    parser.add_option('--reactions', type='int', default=5,
+            help='upgrades and tests per size [%default]')
+    parser.add_option('--latency', type='float', default=0.0,
+            help='simulated daemon latency in seconds [%default]')
+    parser.add_option('--phase-time', type='float', default=0.2,
+            help='duration of upgrades and tests in seconds [%default]')
+    options, _ = parser.parse_args()
+
+    for rdrs in [int(s) for s in options.sizes.split(',')]:
+        with _Quiet():
+            rows, reactions = benchmark(rdrs, options)
+        print '%d RDRs' % rdrs
+        print '  %-32s %10s %6s %10s %6s' % ('keyword', 'cold ms', 'calls',
+                'warm ms', 'calls')
+        for name, cold, cold_calls, warm, warm_calls in rows:
+            print '  %-32s %10.3f %6d %10.3f %6.2f' % (name, cold * 1e3,
+                    cold_calls, warm * 1e3, warm_calls)
+        print '  wait reaction: upgrade state %.1f ms, test status %.1f ms' \
+                % (reactions[0] * 1e3, reactions[1] * 1e3)
+
+if __name__ == '__main__':
+    main()
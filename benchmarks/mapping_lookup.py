@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+#
+# Copyright 2014 Kontron Europe GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compares the lookup tables of the mapping helpers with the former scan
+of `dir(pyhpi.sahpi)` on every lookup.
+
+Usage: python benchmarks/mapping_lookup.py [number]
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import pyhpi.sahpi
+from robot.utils import normalizing
+
+from HpiLibrary import mapping
+
+# Names looked up by the keywords, with their prefixes.
+LOOKUPS = (
+    ('FUMI', 'SAHPI_ET_'),
+    ('INSTALL_DONE', 'SAHPI_FUMI_'),
+    ('ROLLBACK_FAILED', 'SAHPI_FUMI_'),
+    ('FINISHED_NO_ERRORS', 'SAHPI_DIMITEST_STATUS_'),
+    ('0x10', 'SAHPI_FUMI_'),
+)
+
+def scan_dir(attr, prefix):
+    """The lookup as it was done before the tables were added."""
+    attr = str(attr)
+    for i_attr in dir(pyhpi.sahpi):
+        normalized_i_attr = normalizing.normalize(i_attr, ignore='_')
+        normalized_attr = normalizing.normalize(prefix + attr, ignore='_')
+        if normalized_i_attr == normalized_attr:
+            return getattr(pyhpi.sahpi, i_attr)
+    return int(attr, 0)
+
+def lookup_all(find):
+    for attr, prefix in LOOKUPS:
+        find(attr, prefix)
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    for attr, prefix in LOOKUPS:
+        assert scan_dir(attr, prefix) == \
+                mapping._find_attribute(attr, prefix), attr
+
+    print '%d lookups each, %d names in pyhpi.sahpi' % (
+            number * len(LOOKUPS), len(dir(pyhpi.sahpi)))
+    results = []
+    for name, find in (('dir() scan', scan_dir),
+            ('lookup tables', mapping._find_attribute)):
+        elapsed = min(timeit.repeat(lambda: lookup_all(find), repeat=3,
+                number=number))
+        per_lookup = elapsed / (number * len(LOOKUPS))
+        results.append(per_lookup)
+        print '%-14s %10.2f us per lookup' % (name, per_lookup * 1e6)
+    print 'speedup        %10.1fx' % (results[0] / results[1])
+
+if __name__ == '__main__':
+    main()
@@ -12,29 +12,99 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import functools
 import os
+import sys
+import threading
 import time
-
-from utils import int_any_base, Logging, PerConnectionStorage
+from collections import namedtuple
+
+from utils import int_any_base, approximate_size, ConnectionState, \
+        LazyModule, Logging, PerConnectionStorage
+from inventory import InventoryCache, iter_inventory, write_inventory, \
+        diff_inventory
+from events import EventHistory, EventRecorder, EventReplayer, \
+        DEFAULT_HISTORY_SIZE
+from telemetry import UpgradeTelemetry
+from results import TestResult
+from dimitest import TestParameters
+from waits import Condition, wait_for_conditions
+from soak import MetricsFile, SoakRun
+import instrumentation
+import engine
+import pool
 
 from mapping import *
 
-from pyhpi import Session, EntityPath, FumiRdr, DimiRdr
-from pyhpi.utils import event_type_str
-from pyhpi.utils import fumi_upgrade_status_str, dimi_test_status_str
-from pyhpi.errors import SaHpiError
-from pyhpi.sahpi import SAHPI_ET_FUMI, SAHPI_ET_DIMI
-from robot.utils.connectioncache import ConnectionCache
-from robot.utils import asserts
 from robot.utils import secs_to_timestr, timestr_to_secs
 
+# pyhpi and the Robot Framework modules only needed by keywords are
+# imported on first use, so loading the library for libdoc or a dry-run
+# stays cheap. The same goes for the image server, which pulls in the HTTP
+# server modules Robot Framework does not load itself.
+pyhpi = LazyModule('pyhpi')
+hpi_utils = LazyModule('pyhpi.utils')
+hpi_errors = LazyModule('pyhpi.errors')
+sahpi = LazyModule('pyhpi.sahpi')
+connectioncache = LazyModule('HpiLibrary.connectioncache')
+asserts = LazyModule('robot.utils.asserts')
+imageserver = LazyModule('HpiLibrary.imageserver')
+
+# Polling interval used right after a state change. It is doubled each
+# time no matching event arrives until the configured poll interval is
+# reached.
+MIN_POLL_INTERVAL = 0.05
+
+_BANK_FIELDS = ['size', 'identifier', 'description', 'date_time',
+        'major_version', 'minor_version', 'aux_version']
+_SOURCE_FIELDS = ['source_uri', 'source_status']
+
+BankInfo = namedtuple('BankInfo', _BANK_FIELDS + _SOURCE_FIELDS)
+_BankFields = namedtuple('_BankFields', _BANK_FIELDS)
+_SourceFields = namedtuple('_SourceFields', _SOURCE_FIELDS)
+
+# The HPI client library takes the daemon address from the environment,
+# which is shared by all threads.
+_session_open_lock = threading.Lock()
+
+class _HpiConnectionState(ConnectionState):
+    __slots__ = ('entity_path', 'inventory', 'selected_rdr', 'fumi_number',
+            'selected_fumi_bank', 'selected_fumi_bank_key', 'bank_info',
+            'bank_source_info', 'upgrade_telemetry', 'dimi_number', 'selected_dimi_test',
+            'selected_dimi_test_key',
+            'dimi_batch_results', 'events', 'selected_event',
+            'event_recorder', 'event_replayer', 'selected_resources',
+            'test_result', 'test_parameters', 'soak_run')
+
+# State kept per resource by `Run Keyword On Selected Resources`. All other
+# state is shared with the connection.
+_RESOURCE_SPECIFIC_STATE = ('entity_path', 'selected_rdr',
+        'selected_fumi_bank', 'selected_fumi_bank_key', 'bank_info',
+        'bank_source_info', 'selected_dimi_test', 'selected_dimi_test_key', 'test_parameters',
+        'test_result', 'dimi_batch_results', 'selected_event',
+        'selected_resources', 'soak_run')
+
+def _running_soaks(state):
+    """Returns the running soak runs of a connection state and of the
+    resources selected in it."""
+    states = [state] + list(state.get('selected_resources') or ())
+    return [s['soak_run'] for s in states
+            if 'soak_run' in s and s['soak_run'].running]
+
+def _is_failed_upgrade_state(state):
+    state = hpi_utils.fumi_upgrade_status_str(state)
+    return 'FAILED' in state or 'CANCELLED' in state
+
 class HpiLibrary(Logging, PerConnectionStorage):
-    def __init__(self, timeout=10.0, poll_interval=1.0):
-        PerConnectionStorage.__init__(self, '_active_session')
-        self._cache = ConnectionCache()
+    def __init__(self, timeout=10.0, poll_interval=1.0, parallel_workers=4):
+        PerConnectionStorage.__init__(self, '_s', _HpiConnectionState)
+        self._connections = None
         self._active_session = None
-        self._timeout = timeout
-        self._poll_interval = poll_interval
+        self._worker = threading.local()
+        self._timeout = timestr_to_secs(timeout)
+        self._poll_interval = timestr_to_secs(poll_interval)
+        self._parallel_workers = int(parallel_workers)
+        self.ROBOT_LIBRARY_LISTENER = instrumentation.Listener()
 
     def set_timeout(self, timeout):
         """Sets the timeout used in `Wait Until X` keywords to the given value.
@@ -54,9 +124,41 @@ class HpiLibrary(Logging, PerConnectionStorage):
         self._timeout = timestr_to_secs(timeout)
         return secs_to_timestr(old)
 
+    def set_parallel_workers(self, number):
+        """Sets the maximum number of resources handled at the same time by
+        the `X In Parallel` keywords.
+
+        The old value is returned and can be used to restore it later.
+        """
+
+        old = self._parallel_workers
+        self._parallel_workers = int(number)
+        return old
+
+    def _run_in_parallel(self, func, args_list):
+        """Calls `func` once for each argument tuple in `args_list` using
+        the worker threads of the engine and returns the results in
+        order.
+
+        The log messages of all calls are dropped.
+        """
+        func = functools.partial(self._quietly, func)
+        statistics = instrumentation.statistics()
+        if statistics is not None:
+            func = statistics.attributed(func)
+        return engine.engine().map(func, args_list,
+                max(1, self._parallel_workers))
+
+    @property
+    def _cache(self):
+        if self._connections is None:
+            self._connections = connectioncache.HpiConnectionCache()
+        return self._connections
+
     @property
     def _s(self):
-        return self._active_session
+        # Worker threads of the fan-out keywords use their own session.
+        return getattr(self._worker, 'session', self._active_session)
 
     def open_hpi_connection(self, host, port=4743, alias=None):
         """Opens an HPI session.
@@ -67,19 +169,197 @@ class HpiLibrary(Logging, PerConnectionStorage):
 
         port = int(port)
 
-        self._info('Opening connection to %s:%d' % (host, port))
+        self._info('Opening connection to %s:%d', host, port)
 
-        os.environ["OPENHPI_DAEMON_HOST"] = str(host)
-        os.environ["OPENHPI_DAEMON_PORT"] = str(port)
+        return self._register_session(self._open_session(host, port), alias)
 
-        session = Session()
-        session.open()
+    def _instrument(self, session):
+        statistics = instrumentation.statistics()
+        if statistics is not None:
+            session = instrumentation.wrap(session, statistics, 'session')
+        return session
+
+    def _open_session(self, host, port):
+        session_pool = pool.pool()
+        if session_pool is not None:
+            return session_pool.acquire(host, port, self._new_session, self)
+        return self._new_session(host, port)
+
+    def _new_session(self, host, port):
+        with _session_open_lock:
+            os.environ["OPENHPI_DAEMON_HOST"] = str(host)
+            os.environ["OPENHPI_DAEMON_PORT"] = str(port)
+            session = self._instrument(pyhpi.Session())
+            session.open()
         session.attach_event_listener()
+        return session
 
+    def _register_session(self, session, alias, inventory=None):
         self._active_session = session
+        if inventory is not None:
+            self._cp['inventory'] = inventory
+        self._cp['upgrade_telemetry'] = UpgradeTelemetry()
+        # The drainer thread mostly waits in the listener, so its calls are
+        # not timed.
+        self._cp['events'] = EventHistory(
+                instrumentation.unwrap(session.event_listener),
+                callbacks=[self._inventory().event_seen,
+                    self._cp['upgrade_telemetry'].event_seen])
+        self._cp.add_release_hook(self._cp['events'].stop)
 
         return self._cache.register(session, alias)
 
+    def _open_and_discover(self, host, port):
+        try:
+            session = self._open_session(host, port)
+            inventory = InventoryCache(session)
+            inventory.resources()
+            return session, inventory, None
+        except Exception, e:
+            return None, None, e
+
+    def open_hpi_connections(self, *connections):
+        """Opens several HPI sessions at the same time.
+
+        Each connection is given in the form `[alias=]host[:port]`. Besides
+        opening the sessions, the RPT tables are fetched in parallel, too.
+        At most the number of connections set with `Set Parallel Workers`
+        are opened at the same time. The last opened connection becomes the
+        active one.
+
+        Returns the list of indexes of the opened connections. Fails after
+        registering the successfully opened connections if any connection
+        could not be opened.
+
+        Example:
+        | Open HPI Connections | shmm1=10.0.0.1 | shmm2=10.0.0.2:4743 |
+        """
+        specs = []
+        for connection in connections:
+            alias = None
+            if '=' in connection:
+                alias, connection = connection.split('=', 1)
+            port = 4743
+            if ':' in connection:
+                connection, port = connection.rsplit(':', 1)
+            specs.append((connection, int(port), alias))
+
+        self._info('Opening connections to %s', ', '.join(
+                '%s:%d' % spec[:2] for spec in specs))
+        results = self._run_in_parallel(self._open_and_discover,
+                [spec[:2] for spec in specs])
+
+        indexes = []
+        errors = []
+        for (host, port, alias), (session, inventory, error) in \
+                zip(specs, results):
+            if error is not None:
+                errors.append('%s:%d: %s' % (host, port, error))
+                continue
+            indexes.append(self._register_session(session, alias, inventory))
+        if errors:
+            raise RuntimeError('Could not open all connections:\n%s'
+                    % '\n'.join(errors))
+        return indexes
+
+    def _run_on_session(self, session, method, args):
+        self._worker.session = session
+        try:
+            return method(*args), None
+        except Exception, e:
+            return None, e
+        finally:
+            del self._worker.session
+
+    def run_keyword_on_hpi_connections(self, connections, name, *args):
+        """Runs a keyword of this library on several connections at the same
+        time.
+
+        `connections` is a list or a comma separated string of indexes or
+        aliases. If it is empty or `ALL`, the keyword is run on all open
+        connections. At most the number of connections set with `Set
+        Parallel Workers` are handled at the same time.
+
+        Keywords run this way use the state, like the selected entity path,
+        of the connection they run on. Their log messages are dropped.
+
+        Returns a dictionary mapping each index or alias to the return value
+        of the keyword. Fails with a report of all failed connections if the
+        keyword failed on any of them.
+
+        Example:
+        | Run Keyword On HPI Connections | shmm1, shmm2 | Entity Path Should Exist | {SYSTEM_CHASSIS,1} |
+        """
+        if isinstance(connections, basestring):
+            connections = [c.strip() for c in connections.split(',')
+                    if c.strip()]
+        if not connections or connections == ['ALL']:
+            connections = [index for index, _ in
+                    self._cache.open_connections()]
+        method_name = name.strip().lower().replace(' ', '_')
+        method = getattr(self, method_name, None)
+        if method_name.startswith('_') or not callable(method):
+            raise RuntimeError('No keyword "%s" found' % name)
+
+        sessions = [self._cache.get_connection(c) for c in connections]
+        results = self._run_in_parallel(self._run_on_session,
+                [(session, method, args) for session in sessions])
+
+        errors = ['%s: %s' % (c, error)
+                for c, (_, error) in zip(connections, results)
+                if error is not None]
+        if errors:
+            raise AssertionError('%s failed on %d of %d connections:\n%s'
+                    % (name, len(errors), len(results), '\n'.join(errors)))
+        return dict((c, result) for c, (result, _) in zip(connections,
+                results))
+
+    def enable_hpi_call_instrumentation(self, output=None):
+        """Enables timing of all calls to the HPI daemon.
+
+        Only connections opened after this keyword are instrumented. The
+        statistics are kept for the whole process. If `output` is given,
+        they are written to that file at the end of each suite, as CSV if
+        the file name ends with `.csv` and as JSON otherwise.
+
+        See `Get HPI Call Statistics`.
+        """
+        instrumentation.enable(output)
+
+    def _call_statistics(self):
+        statistics = instrumentation.statistics()
+        if statistics is None:
+            raise RuntimeError('HPI call instrumentation is not enabled')
+        return statistics
+
+    def get_hpi_call_statistics(self, keyword=None):
+        """Returns the statistics of the HPI calls made so far.
+
+        The result is a list of dictionaries with the keys `call`, `count`,
+        `errors`, `total`, `mean`, `p50`, `p90`, `p99` and `max`. All times
+        are in seconds. Without `keyword`, the totals of each call are
+        returned, otherwise only the calls made by that keyword.
+        """
+        keyword = keyword or ''
+        rows = [row for row in self._call_statistics().as_rows()
+                if row['keyword'] == keyword]
+        self._info('%s', '\n'.join('%(call)s: %(count)d calls, %(errors)d '
+                'errors, %(total).3fs total, %(p90)ss p90' % row
+                for row in rows))
+        return rows
+
+    def write_hpi_call_statistics(self, path):
+        """Writes the HPI call statistics of all keywords to `path`.
+
+        The file is written as CSV if its name ends with `.csv` and as JSON
+        otherwise.
+        """
+        self._call_statistics().write(path)
+
+    def reset_hpi_call_statistics(self):
+        """Clears the HPI call statistics."""
+        self._call_statistics().reset()
+
     def switch_hpi_connection(self, index_or_alias):
         """Switches between opened HPI session usigg an index or alias.
 
@@ -90,13 +370,23 @@ class HpiLibrary(Logging, PerConnectionStorage):
         """
 
         old_index = self._cache.current_index
-        self._active_device = self._cache.switch(index_or_alias)
+        self._active_session = self._cache.switch(index_or_alias)
         return old_index
 
     def close_hpi_connection(self, loglevel=None):
         """Closes the current HPI session.
+
+        If the connection pool is enabled, the session is handed back to the
+        pool instead. See `Enable HPI Connection Pool`. The index and alias
+        of the closed connection cannot be used anymore. Does nothing if no
+        connection is active.
         """
-        self._active_session.close()
+        session = self._active_session
+        if not any(s is session for _, s in self._cache.open_connections()):
+            return
+        self._close_sessions([session])
+        self._cache.remove(session)
+        self._active_session = self._cache.current
 
     def close_all_hpi_connections(self):
         """Closes all open HPI sessions and empties the connection cache.
@@ -107,21 +397,230 @@ class HpiLibrary(Logging, PerConnectionStorage):
         This keyword should be used in a test or suite teardown to
         make sure all connections to devices are closed.
         """
-        self._active_session = self._cache.close_all()
+        self._close_sessions([session for _, session in
+                self._cache.open_connections()])
+        self._cache.empty_cache()
+        self._active_session = self._cache.current
+
+    def _close_sessions(self, sessions):
+        runs = []
+        for session in sessions:
+            state = self._cp_storage.get(session)
+            if state is not None:
+                runs.extend(_running_soaks(state))
+        # Background soak runs use the state and the session, so they have
+        # to end before either is released.
+        for run in runs:
+            run.stop()
+        for run in runs:
+            if not run.wait(self._timeout):
+                self._warn('Soak run did not stop within %s',
+                        secs_to_timestr(self._timeout))
+        histories = []
+        for session in sessions:
+            state = self._cp_storage.get(session)
+            if state is not None and 'events' in state:
+                histories.append(state['events'])
+            self._cp_release(session)
+        # Releasing the state only tells the event drainer threads to stop,
+        # so they all stop at the same time.
+        for history in histories:
+            history.join()
+        session_pool = pool.pool()
+        for session in sessions:
+            if session_pool is None or \
+                    not session_pool.release(session, self):
+                session.close()
+
+    def enable_hpi_connection_pool(self, max_idle='5 minutes',
+            check_interval='30 seconds'):
+        """Keeps the sessions of closed connections open for reuse.
+
+        With the pool enabled, `Close HPI Connection` and `Close All HPI
+        Connections` hand the sessions back to a process wide pool, and
+        the `Open HPI Connection` keywords take an open session to the same
+        host and port from it if there is one. All state of the closed
+        connection, like the selected entity path and the received events,
+        is dropped when its session is handed back.
+
+        Sessions idle for longer than `check_interval` are checked with a
+        RPT lookup before they are reused. Sessions idle for longer than
+        `max_idle` are closed. Events received while a session is idle are
+        dropped. Calling this keyword again changes the settings of the
+        pool.
+
+        Example:
+        | Enable HPI Connection Pool | max_idle=10 minutes |
+        """
+        pool.enable(timestr_to_secs(max_idle),
+                timestr_to_secs(check_interval))
+
+    def disable_hpi_connection_pool(self):
+        """Disables the connection pool and closes all idle sessions."""
+        pool.disable()
+
+    def get_hpi_connection_pool_statistics(self):
+        """Returns the statistics of the connection pool.
+
+        The result is a dictionary with the keys `hits`, `misses`,
+        `failed_checks`, `evicted`, `idle` and `in_use`.
+        """
+        session_pool = pool.pool()
+        if session_pool is None:
+            raise RuntimeError('HPI connection pool is not enabled')
+        statistics = session_pool.statistics()
+        self._info('%s', ', '.join('%s=%s' % item
+                for item in sorted(statistics.items())))
+        return statistics
+
+    def get_connection_memory_usage(self):
+        """Returns the approximate memory used by the state of each open
+        connection, in bytes.
+
+        The state includes the cached inventory, the event history and the
+        selected objects, but not the session itself. The result maps the
+        connection indexes to their sizes. The sizes per state item are
+        logged on debug level.
+        """
+        usage = dict()
+        for index, session in self._cache.open_connections():
+            state = self._cp_storage.get(session)
+            if state is None:
+                usage[index] = 0
+                continue
+            seen = set([id(session)])
+            sizes = [(key, approximate_size(value, seen))
+                    for key, value in state.items()]
+            usage[index] = sys.getsizeof(state) + \
+                    sum(size for _, size in sizes)
+            self._debug_lines('Connection %d uses %d bytes:'
+                    % (index, usage[index]),
+                    ('%s: %d' % item for item in sorted(sizes)))
+        return usage
 
     def set_entity_path(self, ep):
         """Sets the entity path all further keywords operates on."""
 
         try:
-            ep = EntityPath().from_string(ep)
+            ep = pyhpi.EntityPath().from_string(ep)
         except ValueError:
             raise RuntimeError('Invalid entity path "%s"' % ep)
-        self._info('Setting entity path to %s' % (ep,))
+        self._info('Setting entity path to %s', ep)
         self._cp['entity_path'] = ep
 
+    def _inventory(self):
+        if 'inventory' not in self._cp:
+            self._cp['inventory'] = InventoryCache(self._s)
+        return self._cp['inventory']
+
+    def invalidate_inventory_cache(self):
+        """Forces the RPT and RDR tables to be fetched again.
+
+        The tables are cached per connection and are invalidated
+        automatically when a resource or hotswap event is seen by one of the
+        event keywords.
+        """
+        self._inventory().invalidate()
+
+    def select_resources(self, pattern):
+        """Selects all resources whose entity path matches `pattern`.
+
+        `pattern` is an entity path with shell style wildcards: `*` matches
+        any text, `?` any single character. It is matched against the
+        cached RPT table, which is fetched at most once. Fails if no
+        resource matches, otherwise returns the number of selected
+        resources.
+
+        The selected resources are used by `Run Keyword On Selected
+        Resources`. `Set Entity Path` is not affected.
+
+        Example:
+        | Select Resources | {SYSTEM_CHASSIS,1}{PHYSICAL_SLOT,*} |
+        """
+        resources = self._inventory().resources_matching(pattern)
+        if not resources:
+            self._debug_lines('Known entity paths:',
+                    (res.rpt.entity_path
+                        for res in self._inventory().resources()))
+            raise AssertionError('No RPT with an entity path matching %s'
+                    % pattern)
+        self._info('Selected %d resources matching %s', len(resources),
+                pattern)
+        states = []
+        for res in resources:
+            state = _HpiConnectionState()
+            state['entity_path'] = res.rpt.entity_path
+            states.append(state)
+        self._cp['selected_resources'] = states
+        return len(resources)
+
+    def _share_state(self, state):
+        for key, value in self._cp.items():
+            if key not in _RESOURCE_SPECIFIC_STATE:
+                state[key] = value
+        return state
+
+    def _run_on_resource(self, session, state, method, args):
+        self._worker.session = session
+        self._cp_set_local(state)
+        try:
+            return method(*args), None
+        except Exception, e:
+            return None, e
+        finally:
+            self._cp_set_local(None)
+            del self._worker.session
+
+    def run_keyword_on_selected_resources(self, name, *args):
+        """Runs a keyword of this library on all resources selected with
+        `Select Resources`.
+
+        The keyword is run once per resource as if the entity path of the
+        resource was set with `Set Entity Path`. At most the number of
+        resources set with `Set Parallel Workers` are handled at the same
+        time. Selections made by the keyword, like the FUMI RDR or the bank,
+        are kept per resource until `Select Resources` is called again, so
+        a sequence of keywords can be run on all resources. Their log
+        messages are dropped.
+
+        Returns a dictionary mapping the entity paths to the return values
+        of the keyword. Fails with a report of all failed resources if the
+        keyword failed on any of them.
+
+        Example:
+        | Select Resources | {SYSTEM_CHASSIS,1}{PHYSICAL_SLOT,*} |
+        | Run Keyword On Selected Resources | Product Id Of Selected Resource Should Be | 0x1234 |
+        | Run Keyword On Selected Resources | Select FUMI RDR | IPMC |
+        | Run Keyword On Selected Resources | Select Bank Number | 1 |
+        | Run Keyword On Selected Resources | Start Installation |
+        """
+        states = self._cp.get('selected_resources')
+        if not states:
+            raise RuntimeError('No resources selected')
+        method_name = name.strip().lower().replace(' ', '_')
+        method = getattr(self, method_name, None)
+        if method_name.startswith('_') or not callable(method):
+            raise RuntimeError('No keyword "%s" found' % name)
+
+        # Make sure the inventory is shared by all resources.
+        self._inventory()
+        session = self._s
+        results = self._run_in_parallel(self._run_on_resource,
+                [(session, self._share_state(state), method, args)
+                    for state in states])
+
+        paths = [str(state['entity_path']) for state in states]
+        errors = ['%s: %s' % (ep, error)
+                for ep, (_, error) in zip(paths, results)
+                if error is not None]
+        if errors:
+            raise AssertionError('%s failed on %d of %d resources:\n%s'
+                    % (name, len(errors), len(results), '\n'.join(errors)))
+        return dict((ep, result) for ep, (result, _) in zip(paths, results))
+
     def _selected_resource(self):
         path = self._cp['entity_path']
-        res = self._s.get_resources_by_entity_path(path)
+        res = self._inventory().resources_by_entity_path(path)
         if len(res) != 1:
             raise RuntimeError('More than one resources were retrieved using '
                     'the entity path (%s)' % (path,))
@@ -129,13 +628,15 @@ class HpiLibrary(Logging, PerConnectionStorage):
 
     def _find_rdr(self, rdr_type, id):
         res = self._selected_resource()
-        for rdr in res.rdrs():
-            self._debug('Found RDR type "%d" id "%s"' % (rdr.rdr_type,
-                rdr.id_string))
-            if isinstance(rdr, rdr_type) and rdr.id_string == id:
-                self._debug('Found match')
-                return rdr
-        return None
+        rdr = self._inventory().find_rdr(res, rdr_type, id)
+        if rdr is not None:
+            self._debug('Found RDR type "%d" id "%s"', rdr.rdr_type,
+                    rdr.id_string)
+        else:
+            self._debug_lines('RDRs of %s:' % res.rpt.entity_path,
+                    ('type "%d" id "%s"' % (r.rdr_type, r.id_string)
+                        for r in self._inventory().rdrs(res)))
+        return rdr
 
     def _rdr_should_exist(self, rdr_type, id):
         rdr = self._find_rdr(rdr_type, id)
@@ -150,15 +651,58 @@ class HpiLibrary(Logging, PerConnectionStorage):
     # General
     ###
     def entity_path_should_exist(self, ep):
-        ep = EntityPath().from_string(ep)
-        for res in self._s.resources():
-            self._debug('%s' % res.rpt)
-            if res.rpt.entity_path == ep:
-                break
-        else:
+        ep = pyhpi.EntityPath().from_string(ep)
+        if not self._inventory().resources_by_entity_path(ep):
+            self._debug_lines('Known entity paths:',
+                    (res.rpt.entity_path
+                        for res in self._inventory().resources()))
             raise AssertionError('An RPT with entity path %s does not exist'
                     % (ep,))
 
+    def export_inventory(self, path):
+        """Writes the RPT and RDR tables to `path`.
+
+        Each line of the file is a JSON object describing one resource with
+        its entity path, resource ID, product and manufacturer ID and the
+        type and ID string of all its RDRs. Returns the number of written
+        resources.
+
+        The tables are always fetched again, so the file reflects the
+        current inventory even if no event invalidated the cache.
+
+        The file can be used as baseline for `Inventory Should Match
+        Baseline`.
+        """
+        inventory = self._inventory()
+        inventory.invalidate()
+        count = write_inventory(iter_inventory(inventory), path)
+        self._info('Wrote %d resources to %s', count, path)
+        return count
+
+    def inventory_should_match_baseline(self, path):
+        """Fails unless the RPT and RDR tables match those stored in `path`.
+
+        Resources are matched by their entity path. Their product and
+        manufacturer ID and their RDRs have to be the same. Resource IDs
+        are not compared. All differences are reported at once. Like in
+        `Export Inventory`, the tables are always fetched again.
+
+        See `Export Inventory`.
+        """
+        inventory = self._inventory()
+        inventory.invalidate()
+        missing, unexpected, changed = diff_inventory(
+                iter_inventory(inventory), path)
+        errors = []
+        for title, eps in (('Missing', missing), ('Unexpected', unexpected),
+                ('Changed', changed)):
+            if eps:
+                errors.append('%s resources:\n  %s' % (title,
+                        '\n  '.join(eps)))
+        if errors:
+            raise AssertionError('Inventory does not match baseline %s:\n%s'
+                    % (path, '\n'.join(errors)))
+
     def product_id_of_selected_resource_should_be(self, expected_pid, msg=None,
             values=True):
         expected_pid = int_any_base(expected_pid)
@@ -176,44 +720,301 @@ class HpiLibrary(Logging, PerConnectionStorage):
     ###
     # Events
     ###
-    def clear_event_queue(self):
-        listener = self._s.event_listener
+    def _events(self):
+        return self._cp['events']
+
+    def set_event_history_limits(self, size=DEFAULT_HISTORY_SIZE,
+            max_age=None):
+        """Sets the limits of the event history of the current connection.
+
+        Events are collected in the background as soon as a connection is
+        opened. At most `size` events are kept and, if `max_age` is given in
+        Robot Framework's time format, only events younger than that.
+        Either limit can be disabled by setting it to `None`.
+        """
+        if size is not None and str(size).upper() != 'NONE':
+            size = int(size)
+        else:
+            size = None
+        if max_age is not None and str(max_age).upper() != 'NONE':
+            max_age = timestr_to_secs(max_age)
+        else:
+            max_age = None
+        self._events().set_limits(size, max_age)
+
+    def start_event_recording(self, path):
+        """Appends all events received on the current connection to `path`.
+
+        Each event is written as JSON line together with the time it was
+        received. Writes are buffered, the file is complete after `Stop
+        Event Recording` or after the connection is closed.
+
+        See `Replay Recorded Events`.
+        """
+        self.stop_event_recording()
+        recorder = EventRecorder(path)
+        self._cp['event_recorder'] = recorder
+        self._cp.add_release_hook(recorder.close)
+        self._events().add_callback(recorder.record)
+
+    def stop_event_recording(self):
+        """Stops recording the events of the current connection."""
+        recorder = self._cp.pop('event_recorder', None)
+        if recorder is not None:
+            self._cp.remove_release_hook(recorder.close)
+            self._events().remove_callback(recorder.record)
+            recorder.close()
+
+    def replay_recorded_events(self, path, speed=1.0, wait=False):
+        """Feeds the events recorded in `path` to the current connection.
+
+        The events are replayed in the background with their recorded
+        spacing divided by `speed`. A `speed` of 0 replays them as fast as
+        possible. They are seen by the event and `Wait Until X` keywords
+        like received events. If `wait` is given, the keyword returns after
+        all events were replayed.
+
+        Returns the number of replayed events if `wait` is given. Fails if
+        the recording cannot be opened and, if `wait` is given, if it
+        contains an invalid line.
+        """
+        self.stop_event_replay()
+        replayer = EventReplayer(path, self._events(), float(speed))
+        self._cp['event_replayer'] = replayer
+        self._cp.add_release_hook(replayer.stop)
+        if wait:
+            replayer.join()
+            return replayer.count
+
+    def stop_event_replay(self):
+        """Stops replaying events started by `Replay Recorded Events`.
+
+        Fails if the replay was stopped early by an invalid line.
+        """
+        replayer = self._cp.pop('event_replayer', None)
+        if replayer is not None:
+            self._cp.remove_release_hook(replayer.stop)
+            replayer.stop()
+            replayer.join()
+
+    def _wait_until_state(self, get_state, expected, state_str, event_key,
+            may_fail=False, is_final=None, observe=None):
+        """Polls `get_state` until it returns `expected` and returns the last
+        polled state.
+
+        Between two polls the next event matching the `event_key` tuple of
+        event type, source resource and instrument number is awaited. If
+        there is none, the polling interval backs off exponentially up to
+        the configured poll interval. The wait is given up early if
+        `is_final` returns true for the current state. Each state change is
+        passed to `observe`, if given.
+        """
+        events = self._events()
+        since = events.last_seq
+        end_time = time.time() + self._timeout
+        interval = min(MIN_POLL_INTERVAL, self._poll_interval)
+        state = None
         while True:
-            event = listener.get(timeout=0)
-            if event is None:
-                return
+            last_state = state
+            try:
+                state = get_state()
+            except hpi_errors.SaHpiError:
+                if not may_fail:
+                    raise
+            else:
+                if state != last_state:
+                    self._debug('Current state is %s', state_str(state))
+                    if observe is not None:
+                        observe(state)
+                if state == expected:
+                    return state
+                if is_final is not None and is_final(state):
+                    return state
+            timeout = end_time - time.time()
+            if timeout <= 0:
+                return state
+            entry = events.wait(*event_key, timeout=min(interval, timeout),
+                    since=since, may_fail=True)
+            if entry is not None:
+                since = entry.seq
+                interval = min(MIN_POLL_INTERVAL, self._poll_interval)
+            else:
+                interval = min(interval * 2, self._poll_interval)
+
+    def _upgrade_state_condition(self, spec, state):
+        state = find_fumi_upgrade_state(state)
+        bank = self._selected_fumi_bank()
+        key = self._selected_bank_key()
+        telemetry = self._upgrade_telemetry()
+        def poll():
+            current = bank.status()
+            telemetry.observe(key, current)
+            return current == state
+        return Condition(spec, poll, self._fumi_event_key())
+
+    def _test_status_condition(self, spec, status):
+        status = find_dimi_test_status(status)
+        test = self._cp['selected_dimi_test']
+        return Condition(spec, lambda: test.status()[0] == status,
+                self._dimi_event_key())
+
+    def _event_condition(self, spec, event_type):
+        event_type = find_event_type(event_type)
+        events = self._events()
+        state = self._cp
+        def poll():
+            entry = events.wait(event_type, take=True)
+            if entry is None:
+                return False
+            state['selected_event'] = entry.event
+            return True
+        return Condition(spec, poll, (event_type, None, None))
+
+    def _wait_conditions(self, specs):
+        factories = dict(upgrade_state=self._upgrade_state_condition,
+                test_status=self._test_status_condition,
+                event=self._event_condition)
+        conditions = []
+        for spec in specs:
+            try:
+                name, value = spec.split('=', 1)
+            except ValueError:
+                raise RuntimeError('Conditions have to be in form of '
+                        '"name=value"')
+            factory = factories.get(name.strip().lower())
+            if factory is None:
+                raise RuntimeError('Unknown condition "%s", valid are %s'
+                        % (name, ', '.join(sorted(factories))))
+            conditions.append(factory(spec, value.strip()))
+        if not conditions:
+            raise RuntimeError('No conditions given')
+        return conditions
+
+    def _wait_for_conditions(self, specs, wait_for_all):
+        conditions = self._wait_conditions(specs)
+        reached = wait_for_conditions(self._events(), conditions,
+                self._timeout, min(MIN_POLL_INTERVAL, self._poll_interval),
+                self._poll_interval, wait_for_all)
+        self._info('%s', '\n'.join('%s: %s' % (c.name,
+                c.finished and 'reached after %s'
+                    % secs_to_timestr(c.elapsed) or 'not reached')
+                for c in conditions))
+        if any(c.name.strip().lower().startswith('upgrade_state')
+                for c in conditions):
+            self._invalidate_bank_info()
+        if not reached:
+            raise AssertionError('%s of %s reached in %s'
+                    % (wait_for_all and 'Not all' or 'None',
+                        ', '.join(c.name for c in conditions),
+                        secs_to_timestr(self._timeout)))
+        return dict((c.name, c.elapsed) for c in conditions)
+
+    def wait_until_all_of(self, *conditions):
+        """Waits until all given conditions hold.
+
+        Conditions are given in the form `name=value`:
+        - `upgrade_state=<state>`: the selected bank reached the upgrade
+          state, see `Wait Until Upgrade State Is`.
+        - `test_status=<status>`: the selected DIMI test reached the
+          status, see `Wait Until Test Status Is`.
+        - `event=<type>`: an event of the type was received. It is
+          selected like by `Wait Until Event Queue Contains Event Type`.
+
+        All conditions are polled on one schedule and share the timeout
+        and the poll interval, which backs off while nothing changes. A
+        condition is checked again as soon as a related event arrives.
+        Once a condition holds, it is not checked again.
+
+        Returns a dictionary mapping each condition to the seconds it took
+        until it held. The times are logged, too. Fails if not all
+        conditions hold within the timeout.
+
+        Example:
+        | Wait Until All Of | upgrade_state=INSTALL_DONE | event=HOTSWAP |
+        """
+        return self._wait_for_conditions(conditions, True)
+
+    def wait_until_any_of(self, *conditions):
+        """Waits until at least one of the given conditions holds.
+
+        See `Wait Until All Of` for the conditions. Returns as soon as one
+        condition holds. The returned dictionary has the seconds it took
+        for that condition and `None` for all others.
+
+        Example:
+        | Wait Until Any Of | test_status=FINISHED_NO_ERRORS | test_status=FINISHED_ERRORS |
+        """
+        return self._wait_for_conditions(conditions, False)
+
+    def clear_event_queue(self):
+        """Discards all events received so far.
+
+        Returns the number of discarded events. The number of discarded
+        events per event type is logged.
+        """
+        counts = self._events().clear()
+        self._info('%s', '\n'.join('%s: %d' % (hpi_utils.event_type_str(t), n)
+                for t, n in sorted(counts.items())))
+        return sum(counts.values())
+
+    def ignore_events(self, event_type=None, source=None):
+        """Drops the events of the given type and source resource on the
+        current connection from now on.
+
+        Either argument can be omitted to drop the events of all types or
+        sources. Ignored events are discarded as soon as they are received,
+        so they neither fill the event history nor are they recorded.
+        Ignoring `RESOURCE` or `HOTSWAP` events also keeps them from
+        invalidating the inventory cache.
+
+        Example:
+        | Ignore Events | SENSOR |
+        | Ignore Events | HOTSWAP | source=5 |
+        """
+        if event_type is not None:
+            event_type = find_event_type(event_type)
+        if source is not None:
+            source = int_any_base(source)
+        self._events().ignore(event_type, source)
+
+    def clear_ignored_events(self):
+        """Removes all rules set by `Ignore Events` on the current
+        connection.
+
+        Returns the number of events dropped so far per event type.
+        """
+        events = self._events()
+        events.clear_ignored()
+        return dict((hpi_utils.event_type_str(t), n)
+                for t, n in events.dropped().items())
 
     def wait_until_event_queue_contains_event_type(self, event_type,
             may_fail=False):
-        listener = self._s.event_listener
+        """Waits until an event of the given type is received and selects it.
+
+        Events are kept in a history, so events of other types stay
+        available to later calls of this keyword. Each event is selected
+        only once.
+        """
         event_type = find_event_type(event_type)
-        start_time = time.time()
-        end_time = start_time + self._timeout
-        timeout = end_time - time.time()
-        while timeout > 0:
-            try:
-                event = listener.get(timeout)
-                self._debug('Got event %s from queue' %
-                        event_type_str(event.event_type))
-            except SaHpiError:
-                if may_fail:
-                    time.sleep(self._poll_interval)
-                    continue
-                else:
-                    raise
-            if event.event_type == event_type:
-                self._cp['selected_event'] = event
-                return
+        entry = self._events().wait(event_type, timeout=self._timeout,
+                take=True, may_fail=may_fail)
+        if entry is not None:
+            self._debug('Got event %s from queue',
+                    hpi_utils.event_type_str(entry.event.event_type))
+            self._cp['selected_event'] = entry.event
+            return
 
         raise AssertionError('No event with type %s in queue for %s'
-                % (event_type_str(event_type), secs_to_timestr(self._timeout)))
+                % (hpi_utils.event_type_str(event_type),
+                    secs_to_timestr(self._timeout)))
 
     def _selected_event(self):
         return self._cp['selected_event']
 
     def upgrade_state_of_fumi_event_should_be(self, expected_state, msg=None,
             values=True):
-        if self._selected_event().event_type != SAHPI_ET_FUMI:
+        if self._selected_event().event_type != sahpi.SAHPI_ET_FUMI:
             raise RuntimeError('Event is not of type FUMI')
         expected_state = find_fumi_upgrade_state(expected_state)
         actual_state = self._selected_event().status
@@ -221,7 +1022,7 @@ class HpiLibrary(Logging, PerConnectionStorage):
 
     def test_status_of_dimi_event_should_be(self, expected_status, msg=None,
             values=True):
-        if self._selected_event().event_type != SAHPI_ET_DIMI:
+        if self._selected_event().event_type != sahpi.SAHPI_ET_DIMI:
             raise RuntimeError('Event is not of type DIMI')
         expected_status = find_dimi_test_status(expected_status)
         actual_status = self._selected_event().run_status
@@ -240,6 +1041,9 @@ class HpiLibrary(Logging, PerConnectionStorage):
         fumi = res.fumi_handler_by_rdr(rdr)
         bank = fumi.logical_bank()
         self._cp['selected_fumi_bank'] = bank
+        self._cp['selected_fumi_bank_key'] = (res.rpt.resource_id,
+                rdr.fumi_num, 0)
+        self._invalidate_bank_info()
 
     def select_bank_number(self, number):
         number = int(number)
@@ -248,17 +1052,118 @@ class HpiLibrary(Logging, PerConnectionStorage):
         fumi = res.fumi_handler_by_rdr(rdr)
         bank = fumi.bank(number)
         self._cp['selected_fumi_bank'] = bank
+        self._cp['selected_fumi_bank_key'] = (res.rpt.resource_id,
+                rdr.fumi_num, number)
+        self._invalidate_bank_info()
 
     def _selected_fumi_bank(self):
         return self._cp['selected_fumi_bank']
 
+    def _selected_bank_key(self):
+        # Kept from the bank selection, so selecting another RDR later does
+        # not change it.
+        return self._cp['selected_fumi_bank_key']
+
+    def _upgrade_telemetry(self):
+        return self._cp['upgrade_telemetry']
+
+    def _invalidate_bank_info(self):
+        self._cp.pop('bank_info', None)
+        self._cp.pop('bank_source_info', None)
+
+    def _bank_info(self):
+        if 'bank_info' not in self._cp:
+            info = self._selected_fumi_bank().bank_info()
+            self._cp['bank_info'] = _BankFields(info.size,
+                    str(info.identifier), str(info.description),
+                    str(info.date_time), info.major_version,
+                    info.minor_version, info.aux_version)
+            self._upgrade_telemetry().set_bank_size(
+                    self._selected_bank_key(), info.size)
+        return self._cp['bank_info']
+
+    def _bank_source_info(self):
+        # Fetched separately, because only a few keywords need it and
+        # banks without a source may not provide it.
+        if 'bank_source_info' not in self._cp:
+            source = self._selected_fumi_bank().source_info()
+            self._cp['bank_source_info'] = _SourceFields(
+                    str(source.source_uri), source.source_status.value)
+        return self._cp['bank_source_info']
+
+    def get_selected_bank_info(self):
+        """Returns the bank and source information of the selected bank.
+
+        The information is fetched once and reused by this and the `X Of
+        Selected Bank Should Be` keywords until another bank is selected,
+        an upgrade action is started, an upgrade state is reached by `Wait
+        Until Upgrade State Is` or `Refresh Selected Bank Info` is called.
+
+        The returned record has the fields `size`, `identifier`,
+        `description`, `date_time`, `major_version`, `minor_version`,
+        `aux_version`, `source_uri` and `source_status`.
+        """
+        return BankInfo(*(self._bank_info() + self._bank_source_info()))
+
+    def refresh_selected_bank_info(self):
+        """Fetches the information of the selected bank again.
+
+        See `Get Selected Bank Info`.
+        """
+        self._invalidate_bank_info()
+        return self.get_selected_bank_info()
+
+    def selected_bank_info_should_be(self, *fields):
+        """Fails unless all given fields of the selected bank match.
+
+        Fields are given in the form `name=value`. Valid names are `size`,
+        `identifier`, `description`, `datetime`, `version` (given as
+        `major.minor.aux`) and `source_status`. All mismatches are reported
+        at once. See `Get Selected Bank Info` for when the information is
+        fetched.
+
+        Example:
+        | Selected Bank Info Should Be | size=1048576 | version=1.2.0 | source_status=VALID |
+        """
+        actual = dict(size=lambda info: info.size,
+                identifier=lambda info: info.identifier,
+                description=lambda info: info.description,
+                datetime=lambda info: info.date_time,
+                version=lambda info: (info.major_version,
+                    info.minor_version, info.aux_version))
+        errors = []
+        for field in fields:
+            try:
+                name, expected = field.split('=', 1)
+            except ValueError:
+                raise RuntimeError('Fields have to be in form of '
+                        '"name=value"')
+            name = name.strip().lower()
+            if name == 'source_status':
+                value = self._bank_source_info().source_status
+            elif name in actual:
+                value = actual[name](self._bank_info())
+            else:
+                raise RuntimeError('Unknown bank info field "%s"' % name)
+            if name == 'size':
+                expected = int_any_base(expected)
+            elif name == 'version':
+                expected = tuple(int(v) for v in expected.split('.'))
+            elif name == 'source_status':
+                expected = find_fumi_source_status(expected)
+            if expected != value:
+                errors.append('%s: %s != %s' % (name, expected, value))
+        if errors:
+            raise AssertionError('Bank info does not match:\n%s'
+                    % '\n'.join(errors))
+
     def fumi_rdr_should_exist(self, id):
         """Fails unless the specified FUMI RDR exist.
 
         `id` is the ID string of the resource descriptor record. If the RDR is
         found, it will be automatically selected.
         """
-        self._rdr_should_exist(FumiRdr, id)
+        self._rdr_should_exist(pyhpi.FumiRdr, id)
 
     def select_fumi_rdr(self, id):
         """This is just a convenient keyword.
@@ -297,31 +1202,29 @@ class HpiLibrary(Logging, PerConnectionStorage):
 
     def size_of_selected_bank_should_be(self, expected_size, msg=None,
             values=True):
-        info = self._selected_fumi_bank().bank_info()
+        info = self._bank_info()
         expected_size = int(expected_size)
         asserts.assert_equal(expected_size, info.size, msg, values)
 
     def identifier_of_selected_bank_should_be(self, expected_id, msg=None,
             values=True):
-        info = self._selected_fumi_bank().bank_info()
-        asserts.assert_equal(expected_id, str(info.identifier), msg,
-                values)
+        info = self._bank_info()
+        asserts.assert_equal(expected_id, info.identifier, msg, values)
 
     def description_of_selected_bank_should_be(self, expected_description,
             msg=None, values=True):
-        info = self._selected_fumi_bank().bank_info()
-        asserts.assert_equal(expected_description, str(info.description), msg,
+        info = self._bank_info()
+        asserts.assert_equal(expected_description, info.description, msg,
                 values)
 
     def datetime_of_selected_bank_should_be(self, expected_datetime, msg=None,
             values=True):
-        info = self._selected_fumi_bank().bank_info()
-        asserts.assert_equal(expected_datetime, str(info.date_time), msg,
-                values)
+        info = self._bank_info()
+        asserts.assert_equal(expected_datetime, info.date_time, msg, values)
 
     def version_of_selected_bank_should_be(self, expected_major,
             expected_minor, expected_aux, msg=None, values=True):
-        info = self._selected_fumi_bank().bank_info()
+        info = self._bank_info()
         expected_major = int(expected_major)
         expected_minor = int(expected_minor)
         expected_aux = int(expected_aux)
@@ -330,31 +1233,94 @@ class HpiLibrary(Logging, PerConnectionStorage):
                 (info.major_version, info.minor_version, info.aux_version),
                 msg, values)
 
+    def start_image_server(self, host='', port=0, advertised_host=None):
+        """Starts a local HTTP server for firmware images.
+
+        The server listens on `host` and `port`, by default on all
+        interfaces and a free port. URIs returned by `Register Firmware
+        Image` use `advertised_host`, which defaults to `host` or the
+        address of this machine. The server is shared by all library
+        instances and runs until `Stop Image Server` is called; starting it
+        again has no effect.
+
+        Files are sent from a memory mapping, byte ranges are supported and
+        several targets can fetch images at the same time.
+        """
+        server = imageserver.start(host, int(port), advertised_host)
+        self._info('Image server listens on port %d', server.port)
+        return server.port
+
+    def _image_server(self):
+        server = imageserver.server()
+        if server is None:
+            raise RuntimeError('Image server is not running')
+        return server
+
+    def register_firmware_image(self, path, name=None):
+        """Makes the file at `path` available on the image server and
+        returns its URI, to be used with `Set Source`.
+
+        The image is served under `name`, which defaults to the file name.
+
+        Example:
+        | Start Image Server |
+        | ${uri}= | Register Firmware Image | ${IMAGE_DIR}/firmware.bin |
+        | Set Source | ${uri} |
+        """
+        uri = self._image_server().register(path, name)
+        self._info('Serving %s as %s', path, uri)
+        return uri
+
+    def get_image_server_transfer_statistics(self, reset=False):
+        """Returns the transfer statistics of the image server per client.
+
+        The result maps client addresses to dictionaries with the keys
+        `requests`, `bytes`, `elapsed`, `errors`, `rate` (the average rate
+        in bytes per second) and `last_rate` (the rate of the last
+        transfer). The statistics are cleared if `reset` is given.
+        """
+        statistics = self._image_server().statistics(bool(reset))
+        self._info('%s', '\n'.join('%s: %d bytes in %d requests, %s bytes/s'
+                % (client, stats['bytes'], stats['requests'], stats['rate'])
+                for client, stats in sorted(statistics.items())))
+        return statistics
+
+    def stop_image_server(self):
+        """Stops the image server started by `Start Image Server`."""
+        imageserver.stop()
+
     def set_source(self, uri):
+        self._invalidate_bank_info()
         self._selected_fumi_bank().set_source(uri)
 
     def start_validation(self):
+        self._invalidate_bank_info()
         self._selected_fumi_bank().start_validation()
 
     def start_installation(self):
+        self._invalidate_bank_info()
         self._selected_fumi_bank().start_installation()
 
     def start_rollback(self):
+        self._invalidate_bank_info()
         res = self._selected_resource()
         rdr = self._selected_rdr()
         fumi = res.fumi_handler_by_rdr(rdr)
         fumi.start_rollback()
 
     def start_activation(self):
+        self._invalidate_bank_info()
         res = self._selected_resource()
         rdr = self._selected_rdr()
         fumi = res.fumi_handler_by_rdr(rdr)
         fumi.start_activation()
 
     def cancel_upgrade(self):
+        self._invalidate_bank_info()
         self._selected_fumi_bank().cancel()
 
     def cleanup(self):
+        self._invalidate_bank_info()
         self._selected_fumi_bank().cleanup()
 
     def upgrade_state_should_be(self, expected_state, msg=None, values=True):
@@ -362,29 +1328,144 @@ class HpiLibrary(Logging, PerConnectionStorage):
         state = self._selected_fumi_bank().status()
         asserts.assert_equal(expected_state, state, msg, values)
 
+    def _fumi_event_key(self):
+        resource_id, fumi_num, _ = self._selected_bank_key()
+        return (sahpi.SAHPI_ET_FUMI, resource_id, fumi_num)
+
     def wait_until_upgrade_state_is(self, state, may_fail=False):
+        """Waits until the selected bank reaches the given upgrade state.
+
+        The state is checked again as soon as a FUMI event of the selected
+        FUMI arrives. Without events, the state is polled with an increasing
+        interval, up to the one given in the library import.
+        """
         state = find_fumi_upgrade_state(state)
         bank = self._selected_fumi_bank()
-        start_time = time.time()
-        while time.time() < start_time + self._timeout:
-            try:
-                _state = bank.status()
-            except SaHpiError:
-                if may_fail:
-                    time.sleep(self._poll_interval)
-                    continue
-                else:
-                    raise
-            self._debug('Current upgrade state is %s' %
-                    fumi_upgrade_status_str(_state))
-            if _state == state:
-                return
-            time.sleep(self._poll_interval)
+        key = self._selected_bank_key()
+        telemetry = self._upgrade_telemetry()
+        reached = self._wait_until_state(bank.status, state,
+                hpi_utils.fumi_upgrade_status_str, self._fumi_event_key(),
+                may_fail, observe=lambda s: telemetry.observe(key, s)) == state
+        self._invalidate_bank_info()
+        if reached:
+            return
 
         raise AssertionError('Upgrade state %s not reached %s.'
-                % (fumi_upgrade_status_str(state),
+                % (hpi_utils.fumi_upgrade_status_str(state),
                     secs_to_timestr(self._timeout)))
 
+    def _upgrade_bank(self, ep, fumi_id, bank_number, uri, state):
+        result = dict(entity_path=ep, state=None, elapsed=None, error=None,
+                phases=[])
+        telemetry = self._upgrade_telemetry()
+        key = None
+        start_time = time.time()
+        try:
+            res = self._inventory().resources_by_entity_path(
+                    pyhpi.EntityPath().from_string(ep))
+            if len(res) != 1:
+                raise RuntimeError('Entity path matches %d resources'
+                        % len(res))
+            res = res[0]
+            rdr = self._inventory().find_rdr(res, pyhpi.FumiRdr, fumi_id)
+            if rdr is None:
+                raise RuntimeError('No FUMI RDR with id "%s" found' % fumi_id)
+            bank = res.fumi_handler_by_rdr(rdr).bank(bank_number)
+            key = (res.rpt.resource_id, rdr.fumi_num, bank_number)
+            try:
+                telemetry.set_bank_size(key, bank.bank_info().size)
+            except Exception:
+                # The size is only used for the throughput, so the upgrade
+                # goes on without it.
+                pass
+            bank.set_source(uri)
+            bank.start_installation()
+            final_state = self._wait_until_state(bank.status, state,
+                    hpi_utils.fumi_upgrade_status_str,
+                    (sahpi.SAHPI_ET_FUMI, res.rpt.resource_id, rdr.fumi_num),
+                    is_final=_is_failed_upgrade_state,
+                    observe=lambda s: telemetry.observe(key, s))
+            result['state'] = hpi_utils.fumi_upgrade_status_str(final_state)
+        except Exception, e:
+            result['error'] = str(e)
+        result['elapsed'] = time.time() - start_time
+        if key is not None:
+            result['phases'] = telemetry.phases(key)
+        return result
+
+    def upgrade_banks_in_parallel(self, fumi_id, bank_number, uri,
+            expected_state, *entity_paths):
+        """Upgrades a bank of the FUMI with the given ID string on all
+        resources identified by `entity_paths` at the same time.
+
+        On each resource, the source is set to `uri`, the installation is
+        started and the keyword waits until the bank reaches
+        `expected_state`, a failed state or the timeout. At most the
+        number of resources set with `Set Parallel Workers` is upgraded at
+        the same time.
+
+        Returns a list with one dictionary per entity path containing the
+        keys `entity_path`, `state`, `elapsed` (in seconds), `error` and
+        `phases`, the upgrade phases of the bank as described in `Get
+        Upgrade Phase Durations`, which is empty if the bank was not found.
+        Fails with a report of all resources unless every bank reached the
+        expected state.
+
+        Example:
+        | Upgrade Banks In Parallel | IPMC | 1 | tftp://server/fw.img | INSTALL_DONE | @{blades} |
+        """
+        expected_state = find_fumi_upgrade_state(expected_state)
+        bank_number = int(bank_number)
+        results = self._run_in_parallel(self._upgrade_bank,
+                [(ep, fumi_id, bank_number, uri, expected_state)
+                    for ep in entity_paths])
+
+        expected_str = hpi_utils.fumi_upgrade_status_str(expected_state)
+        report = ['%s: %s after %s%s' % (r['entity_path'], r['state'],
+                    secs_to_timestr(r['elapsed']),
+                    r['error'] and ' (%s)' % r['error'] or '')
+                for r in results]
+        self._info('%s', '\n'.join(report))
+        failed = [r for r in results if r['state'] != expected_str]
+        if failed:
+            raise AssertionError('%d of %d banks did not reach upgrade state '
+                    '%s:\n%s' % (len(failed), len(results), expected_str,
+                        '\n'.join(report)))
+        return results
+
+    def get_upgrade_phase_durations(self):
+        """Returns the upgrade phases seen on the selected bank.
+
+        Upgrade states are recorded whenever they are polled by the `Wait
+        Until Upgrade State Is` keyword or received as FUMI event. Each
+        phase (validation, installation, activation, rollback, ...) is
+        returned as dictionary with the keys `phase`, `start`, `end`,
+        `duration` (in seconds) and `outcome`, the state the phase ended
+        with. Finished installations also have a `throughput` in bytes
+        per second, based on the size of the bank.
+        """
+        key = self._selected_bank_key()
+        # Makes the bank size known for the throughput.
+        self._bank_info()
+        phases = self._upgrade_telemetry().phases(key)
+        self._info('%s', '\n'.join('%s: %s after %s' % (p['phase'],
+                    p['outcome'], p['duration'] is not None
+                        and secs_to_timestr(p['duration']) or '-')
+                for p in phases))
+        return phases
+
+    def write_upgrade_metrics(self, path):
+        """Appends the upgrade phases of all banks of the current
+        connection to `path`.
+
+        Each phase is written as JSON line with the fields described in
+        `Get Upgrade Phase Durations` plus the entity path, resource ID,
+        FUMI and bank number.
+        """
+        entity_paths = dict((res.rpt.resource_id, str(res.rpt.entity_path))
+                for res in self._inventory().resources())
+        self._upgrade_telemetry().write(path, entity_paths)
+
     def source_status_should_be(self, expected_status, msg=None, values=True):
         expected_status = find_fumi_source_status(expected_status)
         info = self._selected_fumi_bank().source_info()
@@ -404,7 +1485,7 @@ class HpiLibrary(Logging, PerConnectionStorage):
         A found RDR will be automatically selected. See also `FUMI RDR Should
         Exist` keyword.
         """
-        self._rdr_should_exist(DimiRdr, id)
+        self._rdr_should_exist(pyhpi.DimiRdr, id)
 
     def select_dimi_rdr(self, id):
         """This is just a convenient keyword.
@@ -419,7 +1500,11 @@ class HpiLibrary(Logging, PerConnectionStorage):
         rdr = self._cp['selected_rdr']
         dimi = res.dimi_handler_by_rdr(rdr)
         test = dimi.get_test_by_num(number)
+        self._invalidate_test_result()
         self._cp['selected_dimi_test'] = test
+        self._cp['selected_dimi_test_key'] = (res.rpt.resource_id,
+                rdr.dimi_num, number)
+        self._cp['test_parameters'] = TestParameters(test.parameters)
 
     def dimi_number_of_selected_rdr_should_be(self, expected_num, msg=None,
             values=True):
@@ -447,32 +1532,43 @@ class HpiLibrary(Logging, PerConnectionStorage):
         asserts.assert_equal(expected_capabilities, test.capabilities,
                 msg, values)
 
+    def _test_parameters(self):
+        return self._cp['test_parameters']
+
     def selected_test_should_have_parameter(self, expected_parameter, msg=None,
             values=True):
-        test = self._cp['selected_dimi_test']
-        parameters = [p.name for p in test.parameters]
-        asserts.assert_true(expected_parameter in parameters, msg)
+        asserts.assert_true(expected_parameter in self._test_parameters(),
+                msg)
 
     def default_value_of_parameter_of_selected_test_should_be(self,
             parameter_name, expected_default_value, msg=None, values=True):
-        test = self._cp['selected_dimi_test']
-        try:
-            parameter = filter(
-                    lambda parameter: parameter.name == parameter_name,
-                    test.parameters)[0]
-        except IndexError:
-            raise RuntimeError('Parameter with name "%s" not found.',
-                    parameter_name)
+        """Fails unless the default value of the given parameter of the
+        selected test matches.
+
+        `expected_default_value` is converted to the type of the parameter
+        before it is compared.
+        """
+        parameters = self._test_parameters()
+        parameter = parameters.get(parameter_name)
+        expected_default_value = parameters.convert(parameter_name,
+                expected_default_value)
         asserts.assert_equal(expected_default_value,
                 parameter.default, msg, values)
 
     def start_test(self, *parameters):
-        _parameters = [ p.split('=', 1) for p in parameters ]
-        for p in _parameters:
-            if len(p) != 2:
-                raise RuntimeError('Parameters has to be in form of '
-                        '"name=value"')
+        """Starts the selected test.
+
+        Parameters are given in the form `name=value`. They are checked
+        against the parameter definitions of the test and converted to the
+        type of the parameter before the test is started, so unknown
+        parameters and invalid values fail without starting the test.
+
+        Example:
+        | Start Test | loops=3 | verbose=yes |
+        """
+        _parameters = self._test_parameters().parse(parameters)
         test = self._cp['selected_dimi_test']
+        self._invalidate_test_result()
         test.start(_parameters or None)
 
     def cancel_test(self):
@@ -485,40 +1581,442 @@ class HpiLibrary(Logging, PerConnectionStorage):
         status = test.status()[0]
         asserts.assert_equal(expected_status, status, msg, values)
 
+    def _dimi_event_key(self):
+        resource_id, dimi_num, _ = self._cp['selected_dimi_test_key']
+        return (sahpi.SAHPI_ET_DIMI, resource_id, dimi_num)
+
     def wait_until_test_status_is(self, status):
+        """Waits until the selected test reaches the given status.
+
+        See `Wait Until Upgrade State Is` for how the status is polled.
+        """
         status = find_dimi_test_status(status)
         test = self._cp['selected_dimi_test']
-        start_time = time.time()
-        while time.time() < start_time + self._timeout:
-            _status = test.status()[0]
-            self._debug('Current test status is %s' %
-                    dimi_test_status_str(_status))
-            if _status == status:
-                return
-            time.sleep(self._poll_interval)
+        if self._wait_until_state(lambda: test.status()[0], status,
+                hpi_utils.dimi_test_status_str,
+                self._dimi_event_key()) == status:
+            return
 
         raise AssertionError('Test status %s not reached in %s.'
-                % (dimi_test_status_str(status),
+                % (hpi_utils.dimi_test_status_str(status),
                     secs_to_timestr(self._timeout)))
 
+    def _invalidate_test_result(self):
+        result = self._cp.pop('test_result', None)
+        if result is not None:
+            result.close()
+
+    def _test_result(self):
+        """Returns the results of the selected test.
+
+        Results of a finished run are fetched once and kept until the test
+        is started again or another test is selected.
+        """
+        result = self._cp.get('test_result')
+        if result is not None:
+            return result
+        test = self._cp['selected_dimi_test']
+        result = TestResult(test.results())
+        if result.last_run_status in (
+                sahpi.SAHPI_DIMITEST_STATUS_FINISHED_NO_ERRORS,
+                sahpi.SAHPI_DIMITEST_STATUS_FINISHED_ERRORS,
+                sahpi.SAHPI_DIMITEST_STATUS_CANCELED):
+            self._cp['test_result'] = result
+        if result.path is not None:
+            self._info('Result string of %d bytes written to %s',
+                    result.size, result.path)
+        return result
+
     def error_status_of_test_result_should_be(self, expected_status, msg=None,
             values=True):
         expected_status = find_dimi_test_status_error(expected_status)
-        test = self._cp['selected_dimi_test']
-        result = test.results()
+        result = self._test_result()
         asserts.assert_equal(expected_status, result.error_code, msg,
                 values)
 
     def test_run_status_of_test_result_should_be(self, expected_status,
             msg=None, values=True):
         expected_status = find_dimi_test_status(expected_status)
-        test = self._cp['selected_dimi_test']
-        result = test.results()
+        result = self._test_result()
         asserts.assert_equal(expected_status, result.last_run_status, msg,
                 values)
 
     def result_string_of_test_result_should_be(self, expected_string, msg=None,
             values=True):
+        result = self._test_result()
+        if result.path is None:
+            asserts.assert_equal(expected_string, result.text(), msg, values)
+        elif not result.equals(expected_string):
+            # Long result strings are not included in the message.
+            raise AssertionError(msg or 'Result string of %d bytes in %s '
+                    'does not match' % (result.size, result.path))
+
+    def get_test_result_lines(self, first=1, last=None):
+        """Returns the lines `first` to `last` of the result string of the
+        selected test.
+
+        Lines are counted from 1 and `last` is included. Without `last`, all
+        lines up to the end are returned. Only the returned lines are read
+        if the result string is kept in a file. Lines are separated by
+        newlines, a carriage return before a newline is dropped.
+        """
+        first = int(first)
+        last = int(last) if last is not None else None
+        if first < 1 or (last is not None and last < 1):
+            raise RuntimeError('Line numbers start at 1')
+        return list(self._test_result().lines(first - 1, last))
+
+    def search_test_result(self, pattern, max_matches=None):
+        """Returns the lines of the result string of the selected test
+        which match the regular expression `pattern`.
+
+        At most `max_matches` lines are returned if it is given. The
+        matching lines are logged with their line numbers.
+
+        Example:
+        | @{errors}= | Search Test Result | ^ERROR: .*address 0x[0-9a-f]+ |
+        """
+        if max_matches is not None:
+            max_matches = int(max_matches)
+        matches = self._test_result().search(pattern, max_matches)
+        self._info('%s', '\n'.join('%d: %s' % m for m in matches))
+        return [line for _, line in matches]
+
+    def test_result_should_contain_line_matching(self, pattern, msg=None):
+        """Fails unless a line of the result string of the selected test
+        matches the regular expression `pattern`."""
+        if not self._test_result().search(pattern, 1):
+            raise AssertionError(msg or 'No line of the test result matches '
+                    '"%s"' % pattern)
+
+    def test_result_should_not_contain_line_matching(self, pattern, msg=None):
+        """Fails if a line of the result string of the selected test
+        matches the regular expression `pattern`."""
+        matches = self._test_result().search(pattern, 1)
+        if matches:
+            raise AssertionError(msg or 'Line %d of the test result matches '
+                    '"%s": %s' % (matches[0][0], pattern, matches[0][1]))
+
+    def save_test_result(self, path):
+        """Writes the result string of the selected test to `path`."""
+        self._test_result().save(path)
+
+    def _dimi_tests(self, res, rdr):
+        dimi = res.dimi_handler_by_rdr(rdr)
+        tests = []
+        while True:
+            try:
+                tests.append(dimi.get_test_by_num(len(tests)))
+            except (hpi_errors.SaHpiError, IndexError):
+                # There is no call for the number of tests, so probe until
+                # the test number is rejected.
+                return tests
+
+    def _run_batch_test(self, res, rdr, num, test):
+        result = dict(dimi=rdr.id_string, test=num, name=test.name,
+                status=None, error_code=None, result=None, elapsed=None,
+                error=None)
+        start_time = time.time()
+        try:
+            test.start(None)
+            status = self._wait_until_state(lambda: test.status()[0],
+                    sahpi.SAHPI_DIMITEST_STATUS_FINISHED_NO_ERRORS,
+                    hpi_utils.dimi_test_status_str,
+                    (sahpi.SAHPI_ET_DIMI, res.rpt.resource_id, rdr.dimi_num),
+                    is_final=lambda status: status in (
+                        sahpi.SAHPI_DIMITEST_STATUS_FINISHED_ERRORS,
+                        sahpi.SAHPI_DIMITEST_STATUS_CANCELED))
+            if status not in (sahpi.SAHPI_DIMITEST_STATUS_FINISHED_NO_ERRORS,
+                    sahpi.SAHPI_DIMITEST_STATUS_FINISHED_ERRORS,
+                    sahpi.SAHPI_DIMITEST_STATUS_CANCELED):
+                test.cancel()
+                result['error'] = 'Timeout after %s' % (
+                        secs_to_timestr(self._timeout))
+            results = test.results()
+            result['status'] = hpi_utils.dimi_test_status_str(
+                    results.last_run_status)
+            result['error_code'] = results.error_code
+            result['result'] = results.result
+        except Exception, e:
+            result['error'] = str(e)
+        result['elapsed'] = time.time() - start_time
+        return result
+
+    def run_dimi_test_batch(self, *dimi_ids):
+        """Runs all tests of the DIMIs with the given ID strings on the
+        selected resource.
+
+        Tests without service impact (`NONDEGRADING`) are run in parallel,
+        at most as many as set with `Set Parallel Workers`. All other tests
+        are run afterwards, one at a time. Each test is cancelled if it does
+        not finish within the timeout set with `Set Timeout`.
+
+        The results are fetched once per test and returned as a list of
+        dictionaries with the keys `dimi`, `test`, `name`, `status`,
+        `error_code`, `result`, `elapsed` and `error`. They are kept for
+        `Status Of Batch Test Should Be` and `Batch Tests Should Have
+        Passed`.
+        """
+        res = self._selected_resource()
+        parallel = []
+        exclusive = []
+        for dimi_id in dimi_ids:
+            rdr = self._find_rdr(pyhpi.DimiRdr, dimi_id)
+            if rdr is None:
+                raise RuntimeError('No DIMI RDR with id "%s" found.'
+                        % dimi_id)
+            for num, test in enumerate(self._dimi_tests(res, rdr)):
+                if test.service_impact == sahpi.SAHPI_DIMITEST_NONDEGRADING:
+                    parallel.append((res, rdr, num, test))
+                else:
+                    exclusive.append((res, rdr, num, test))
+
+        results = []
+        if parallel:
+            results.extend(self._run_in_parallel(self._run_batch_test,
+                    parallel))
+        for args in exclusive:
+            results.append(self._run_batch_test(*args))
+        self._cp['dimi_batch_results'] = dict(
+                ((r['dimi'], r['test']), r) for r in results)
+
+        self._info('%s', '\n'.join('%s test %d (%s): %s after %s%s'
+                % (r['dimi'], r['test'], r['name'], r['status'],
+                    secs_to_timestr(r['elapsed']),
+                    r['error'] and ' (%s)' % r['error'] or '')
+                for r in results))
+        return results
+
+    def _batch_test_result(self, dimi_id, test_num):
+        results = self._cp.get('dimi_batch_results')
+        if results is None:
+            raise RuntimeError('No DIMI test batch was run')
+        try:
+            return results[(dimi_id, int(test_num))]
+        except KeyError:
+            raise RuntimeError('Test %s of DIMI "%s" was not run in the last '
+                    'batch' % (test_num, dimi_id))
+
+    def status_of_batch_test_should_be(self, dimi_id, test_num,
+            expected_status, msg=None, values=True):
+        """Fails unless the given test of the last `Run DIMI Test Batch`
+        ended with the expected status."""
+        result = self._batch_test_result(dimi_id, test_num)
+        expected_status = hpi_utils.dimi_test_status_str(
+                find_dimi_test_status(expected_status))
+        asserts.assert_equal(expected_status, result['status'], msg, values)
+
+    def batch_tests_should_have_passed(self):
+        """Fails unless all tests of the last `Run DIMI Test Batch` finished
+        without errors."""
+        passed = hpi_utils.dimi_test_status_str(
+                sahpi.SAHPI_DIMITEST_STATUS_FINISHED_NO_ERRORS)
+        results = self._cp.get('dimi_batch_results')
+        if results is None:
+            raise RuntimeError('No DIMI test batch was run')
+        failed = ['%s test %d: %s%s' % (r['dimi'], r['test'], r['status'],
+                    r['error'] and ' (%s)' % r['error'] or '')
+                for key, r in sorted(results.items())
+                if r['status'] != passed or r['error']]
+        if failed:
+            raise AssertionError('%d of %d tests did not pass:\n%s'
+                    % (len(failed), len(results), '\n'.join(failed)))
+
+    ###
+    # Soak
+    ###
+    def _wait_step(self, bank_or_test_status, expected, state_str, event_key,
+            is_final):
+        state = self._wait_until_state(bank_or_test_status, expected,
+                state_str, event_key, is_final=is_final)
+        if state != expected:
+            return 'ended in %s' % (state is not None and state_str(state)
+                    or 'unknown state')
+        return None
+
+    def _fumi_soak_steps(self, actions):
+        res = self._selected_resource()
+        fumi = res.fumi_handler_by_rdr(self._selected_rdr())
+        bank = self._selected_fumi_bank()
+        logical_bank = fumi.logical_bank()
+        event_key = self._fumi_event_key()
+        cycle = dict(
+            validation=(bank.start_validation, bank,
+                sahpi.SAHPI_FUMI_SOURCE_VALIDATION_DONE),
+            installation=(bank.start_installation, bank,
+                sahpi.SAHPI_FUMI_INSTALL_DONE),
+            activation=(fumi.start_activation, logical_bank,
+                sahpi.SAHPI_FUMI_ACTIVATE_DONE),
+            rollback=(fumi.start_rollback, logical_bank,
+                sahpi.SAHPI_FUMI_ROLLBACK_DONE))
+
+        steps = []
+        for action in actions:
+            action = action.strip().lower()
+            if action not in cycle:
+                raise RuntimeError('Unknown FUMI action "%s", valid are %s'
+                        % (action, ', '.join(sorted(cycle))))
+            start, status_bank, done = cycle[action]
+            def step(start=start, status=status_bank.status, done=done):
+                start()
+                return self._wait_step(status, done,
+                        hpi_utils.fumi_upgrade_status_str, event_key,
+                        _is_failed_upgrade_state)
+            steps.append((action, step))
+        return steps
+
+    def _dimi_soak_steps(self, parameters):
         test = self._cp['selected_dimi_test']
-        result = test.results()
-        asserts.assert_equal(expected_string, result.result, msg, values)
+        parameters = self._test_parameters().parse(parameters) or None
+        event_key = self._dimi_event_key()
+        finished = (sahpi.SAHPI_DIMITEST_STATUS_FINISHED_NO_ERRORS,
+                sahpi.SAHPI_DIMITEST_STATUS_FINISHED_ERRORS,
+                sahpi.SAHPI_DIMITEST_STATUS_CANCELED)
+        def step():
+            test.start(parameters)
+            return self._wait_step(lambda: test.status()[0],
+                    sahpi.SAHPI_DIMITEST_STATUS_FINISHED_NO_ERRORS,
+                    hpi_utils.dimi_test_status_str, event_key,
+                    lambda status: status in finished)
+        return [('test', step)]
+
+    def _start_soak(self, steps, iterations, duration, metrics, max_failures,
+            background):
+        if iterations is None and duration is None:
+            raise RuntimeError('Either iterations or duration has to be '
+                    'given')
+        run = self._cp.get('soak_run')
+        if run is not None and run.running:
+            raise RuntimeError('A soak run is already running on this '
+                    'connection')
+        iterations = int(iterations) if iterations is not None else None
+        duration = timestr_to_secs(duration) if duration is not None else None
+        max_failures = int(max_failures)
+        if metrics is not None:
+            metrics = MetricsFile(metrics)
+        try:
+            run = SoakRun(steps, iterations, duration, max_failures, metrics)
+        except Exception:
+            if metrics is not None:
+                metrics.close()
+            raise
+        # Marks the run as running before a worker thread picks it up, so
+        # it cannot be replaced by another run in the meantime.
+        run.start()
+        self._cp['soak_run'] = run
+        if background:
+            self._cp.add_release_hook(run.stop)
+            engine.engine().submit(self._run_on_resource, self._s, self._cp,
+                    run.run, ())
+            return None
+        run.run()
+        return self._finish_soak(run)
+
+    def _soak_run(self):
+        run = self._cp.get('soak_run')
+        if run is None:
+            raise RuntimeError('No soak run was started on this connection')
+        return run
+
+    def _finish_soak(self, run):
+        statistics = self.get_soak_statistics()
+        if run.failures > run.max_failures:
+            raise AssertionError('Soak run stopped after %d failed of %d '
+                    'iterations, last failure: %s' % (run.failures,
+                        run.iteration, run.last_failure))
+        return statistics
+
+    def run_fumi_soak(self, actions, iterations=None, duration=None,
+            metrics=None, max_failures=0, background=False):
+        """Repeats a cycle of upgrade actions on the selected bank.
+
+        `actions` is a comma separated list of `validation`, `installation`,
+        `activation` and `rollback`. Each action is started and awaited
+        until it is done, like with `Wait Until Upgrade State Is`. A failed
+        action ends its iteration. The cycle is repeated `iterations` times
+        or for `duration` given in Robot Framework's time format, whichever
+        ends first. The run stops early after more than `max_failures`
+        failed iterations and the keyword fails then.
+
+        If `metrics` is given, one JSON line per iteration with the time of
+        each action and the failure, if any, is appended to that file. The
+        file is rotated at 10 MB. Latencies are kept in histograms with
+        fixed buckets, so the memory used does not grow with the number of
+        iterations. See `Get Soak Statistics`.
+
+        With `background`, the keyword returns immediately and the run goes
+        on in the background until it ends or `Stop Soak` is called. Use
+        `Wait For Soak` to wait for it.
+
+        Returns the statistics of the run unless it runs in the background.
+
+        Example:
+        | Set Source | ${uri} |
+        | Run FUMI Soak | installation, activation, rollback | duration=48 hours | metrics=${OUTPUT_DIR}/soak.jsonl |
+        """
+        if isinstance(actions, basestring):
+            actions = [a for a in actions.split(',') if a.strip()]
+        return self._start_soak(self._fumi_soak_steps(actions), iterations,
+                duration, metrics, max_failures, background)
+
+    def run_dimi_soak(self, iterations=None, duration=None, metrics=None,
+            max_failures=0, background=False, parameters=()):
+        """Runs the selected DIMI test repeatedly.
+
+        A test run fails unless it finishes without errors. `parameters` is
+        a list of `name=value` parameters for `Start Test`; they are checked
+        and converted once before the run. See `Run FUMI Soak` for the
+        other arguments.
+
+        Example:
+        | Run DIMI Soak | iterations=1000 | metrics=${OUTPUT_DIR}/dimi.jsonl | parameters=${params} |
+        """
+        if isinstance(parameters, basestring):
+            parameters = [parameters]
+        return self._start_soak(self._dimi_soak_steps(parameters),
+                iterations, duration, metrics, max_failures, background)
+
+    def get_soak_statistics(self):
+        """Returns the statistics of the current or last soak run on the
+        current connection.
+
+        The result is a dictionary with the keys `iterations`, `failures`,
+        `last_failure`, `running`, `elapsed` and `latencies`. `latencies`
+        maps each action, and `iteration` for the whole cycle, to a
+        histogram with the keys `count`, `total`, `mean`, `min`, `max`,
+        `p50`, `p90`, `p99` and `buckets`. The percentiles are the upper
+        bounds of the histogram buckets, whose bounds double from 1 ms on.
+        The statistics can be read while a background run goes on.
+        """
+        statistics = self._soak_run().statistics()
+        self._info('%d iterations, %d failures in %s\n%s',
+                statistics['iterations'], statistics['failures'],
+                secs_to_timestr(statistics['elapsed']),
+                '\n'.join('%s: mean %s, p90 %s, max %s' % (name,
+                    h['mean'], h['p90'], h['max'])
+                    for name, h in sorted(statistics['latencies'].items())))
+        return statistics
+
+    def wait_for_soak(self, timeout=None):
+        """Waits until the soak run started in the background ends and
+        returns its statistics.
+
+        Fails if the run does not end within `timeout`, if given, or if it
+        stopped because of too many failures.
+        """
+        run = self._soak_run()
+        if timeout is not None:
+            if not run.wait(timestr_to_secs(timeout)):
+                raise AssertionError('Soak run did not end in %s' % timeout)
+        else:
+            # A very long timeout keeps the wait interruptible.
+            while not run.wait(3600):
+                pass
+        return self._finish_soak(run)
+
+    def stop_soak(self):
+        """Stops the soak run after the current iteration and returns its
+        statistics."""
+        run = self._soak_run()
+        run.stop()
+        return self.wait_for_soak()
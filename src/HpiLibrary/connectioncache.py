@@ -0,0 +1,53 @@
+# Copyright 2014 Kontron Europe GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Connection cache which allows closing single connections.
+
+With the connection pool enabled, a closed session may be handed out to
+another library instance, or to this one again under a new index. The
+indexes and aliases of a closed connection are therefore kept, but refer
+to a placeholder which fails when it is used.
+"""
+
+from robot.utils.connectioncache import ConnectionCache, NoConnection
+
+
+class _ClosedConnection(NoConnection):
+    pass
+
+
+class HpiConnectionCache(ConnectionCache):
+    def __init__(self):
+        ConnectionCache.__init__(self, 'No open HPI connection.')
+
+    def register(self, connection, alias=None):
+        # A session taken from the pool may still be known under the index
+        # of its previous connection.
+        self.remove(connection)
+        return ConnectionCache.register(self, connection, alias)
+
+    def remove(self, connection):
+        """Replaces all indexes of `connection` by a closed placeholder."""
+        for index, conn in enumerate(self._connections, 1):
+            if conn is connection:
+                self._connections[index - 1] = _ClosedConnection(
+                        'HPI connection %d is closed.' % index)
+        if self.current is connection:
+            self.current = self._no_current
+
+    def open_connections(self):
+        """Returns the indexes and connections of all open connections."""
+        return [(index, conn)
+                for index, conn in enumerate(self._connections, 1)
+                if not isinstance(conn, _ClosedConnection)]
@@ -0,0 +1,113 @@
+# Copyright 2014 Kontron Europe GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from utils import int_any_base, LazyModule
+
+sahpi = LazyModule('pyhpi.sahpi')
+
+INT32_MIN = -2 ** 31
+INT32_MAX = 2 ** 31 - 1
+
+_TRUE_STRINGS = ('1', 'true', 'yes', 'on')
+_FALSE_STRINGS = ('0', 'false', 'no', 'off')
+
+def _to_boolean(value):
+    if isinstance(value, bool):
+        return value
+    if str(value).lower() in _TRUE_STRINGS:
+        return True
+    if str(value).lower() in _FALSE_STRINGS:
+        return False
+    raise ValueError('not a boolean')
+
+def _to_int32(value):
+    value = int_any_base(value)
+    if not isinstance(value, (int, long)):
+        raise ValueError('not an integer')
+    if not INT32_MIN <= value <= INT32_MAX:
+        raise ValueError('out of the 32 bit range')
+    return value
+
+def _to_float64(value):
+    return float(value)
+
+def _to_text(value):
+    return str(value)
+
+_converters = None
+
+def _converter(param_type):
+    global _converters
+    if _converters is None:
+        _converters = {
+            sahpi.SAHPI_DIMITEST_PARAM_TYPE_BOOLEAN: _to_boolean,
+            sahpi.SAHPI_DIMITEST_PARAM_TYPE_INT32: _to_int32,
+            sahpi.SAHPI_DIMITEST_PARAM_TYPE_FLOAT64: _to_float64,
+            sahpi.SAHPI_DIMITEST_PARAM_TYPE_TEXT: _to_text,
+        }
+    return _converters.get(param_type, _to_text)
+
+
+class TestParameters:
+    """Index of the parameter definitions of a DIMI test by name."""
+
+    def __init__(self, parameters):
+        self._parameters = dict((str(p.name), p) for p in parameters)
+
+    def __contains__(self, name):
+        return name in self._parameters
+
+    def names(self):
+        return sorted(self._parameters)
+
+    def get(self, name):
+        try:
+            return self._parameters[name]
+        except KeyError:
+            raise RuntimeError('Parameter with name "%s" not found.' % name)
+
+    def convert(self, name, value):
+        """Converts `value` to the type of parameter `name`."""
+        parameter = self.get(name)
+        try:
+            return _converter(parameter.type)(value)
+        except (TypeError, ValueError, RuntimeError), e:
+            raise RuntimeError('Invalid value "%s" for parameter "%s": %s'
+                    % (value, name, e))
+
+    def parse(self, parameters):
+        """Converts parameters given as `name=value` strings to a list of
+        `(name, value)` tuples.
+
+        All invalid parameters are reported at once.
+        """
+        parsed = []
+        errors = []
+        for parameter in parameters:
+            if '=' not in parameter:
+                errors.append('Parameter "%s" is not in form of "name=value"'
+                        % parameter)
+                continue
+            name, value = parameter.split('=', 1)
+            if name not in self._parameters:
+                errors.append('Unknown parameter "%s", known parameters are '
+                        '%s' % (name, ', '.join(self.names()) or 'none'))
+                continue
+            try:
+                parsed.append((name, self.convert(name, value)))
+            except RuntimeError, e:
+                errors.append(str(e))
+        if errors:
+            raise RuntimeError('\n'.join(errors))
+        return parsed
@@ -0,0 +1,136 @@
+# Copyright 2014 Kontron Europe GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Process wide worker threads for the parallel keywords.
+
+All parallel work of the library, like upgrades, DIMI batches and
+keywords run on several connections, shares one set of worker threads
+instead of creating a thread pool per keyword call. Threads are started on
+demand up to a maximum and are reused afterwards.
+"""
+
+import sys
+import threading
+from Queue import Queue
+
+DEFAULT_MAX_THREADS = 64
+
+class Engine:
+    def __init__(self, max_threads=DEFAULT_MAX_THREADS):
+        self._max_threads = max_threads
+        self._tasks = Queue()
+        self._lock = threading.Lock()
+        self._threads = 0
+        self._idle = 0
+
+    def _start_thread(self):
+        # Called with the lock held.
+        self._threads += 1
+        self._idle += 1
+        thread = threading.Thread(target=self._work,
+                name='HpiEngine-%d' % self._threads)
+        thread.daemon = True
+        thread.start()
+
+    def _work(self):
+        try:
+            while True:
+                func, args = self._tasks.get()
+                with self._lock:
+                    self._idle -= 1
+                try:
+                    func(*args)
+                finally:
+                    with self._lock:
+                        self._idle += 1
+        finally:
+            # Only reached if `func` raised, which ends this thread. It must
+            # not be counted anymore and queued tasks need a replacement.
+            with self._lock:
+                self._threads -= 1
+                self._idle -= 1
+                if not self._tasks.empty() and self._idle == 0:
+                    self._start_thread()
+
+    def submit(self, func, *args):
+        """Runs `func(*args)` in one of the worker threads.
+
+        Exceptions raised by `func` are not handled and end the worker
+        thread.
+        """
+        with self._lock:
+            if self._idle == 0 and self._threads < self._max_threads:
+                self._start_thread()
+        self._tasks.put((func, args))
+
+    def map(self, func, args_list, limit):
+        """Calls `func` once for each argument tuple in `args_list` and
+        returns the results in order.
+
+        At most `limit` calls run at the same time. The calling thread runs
+        calls, too, so nested use from a worker thread cannot deadlock if
+        all worker threads are busy. The first exception raised by any call
+        is raised again after all calls are done. Exceptions not derived
+        from `Exception` also end the thread they were raised in.
+        """
+        results = [None] * len(args_list)
+        errors = []
+        pending = iter(enumerate(args_list))
+        lock = threading.Lock()
+        remaining = [len(args_list)]
+        done = threading.Event()
+        if not args_list:
+            return results
+
+        def run():
+            while True:
+                with lock:
+                    try:
+                        index, args = pending.next()
+                    except StopIteration:
+                        return
+                try:
+                    results[index] = func(*args)
+                except Exception:
+                    errors.append(sys.exc_info())
+                except BaseException:
+                    errors.append(sys.exc_info())
+                    raise
+                finally:
+                    with lock:
+                        remaining[0] -= 1
+                        if remaining[0] == 0:
+                            done.set()
+
+        for _ in range(min(limit, len(args_list)) - 1):
+            self.submit(run)
+        run()
+        # A very long timeout keeps the wait interruptible.
+        while not done.wait(3600):
+            pass
+        if errors:
+            raise errors[0][0], errors[0][1], errors[0][2]
+        return results
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+def engine():
+    """Returns the process wide engine."""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = Engine()
+        return _engine
@@ -0,0 +1,476 @@
+# Copyright 2014 Kontron Europe GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import logging
+import sys
+import threading
+import time
+import weakref
+from collections import deque
+
+from utils import LazyModule
+
+hpi_errors = LazyModule('pyhpi.errors')
+
+# Robot Framework drops log messages of background threads, so failures of
+# the drainer thread are reported through the logging module, too.
+logger = logging.getLogger('HpiLibrary.events')
+
+DEFAULT_HISTORY_SIZE = 10000
+
+# Timeout of a single listener get call. It limits how long it takes to
+# stop the drainer thread.
+DRAIN_TIMEOUT = 0.5
+
+# Maximum number of queued events taken from the listener at once.
+DRAIN_BATCH_SIZE = 256
+
+# Buffer size of event recordings.
+RECORDING_BUFFER_SIZE = 64 * 1024
+
+_RECORDED_TYPES = (int, long, float, basestring, bool, type(None))
+
+def _instrument_num(event):
+    num = getattr(event, 'fumi_num', None)
+    if num is None:
+        num = getattr(event, 'dimi_num', None)
+    return num
+
+def _index_keys(event):
+    source = getattr(event, 'source', None)
+    return set(((event.event_type, None, None),
+            (event.event_type, source, None),
+            (event.event_type, source, _instrument_num(event))))
+
+
+def _drain(history_ref):
+    """Runs the background thread of an event history.
+
+    The history is only referenced while a batch is taken, so the thread
+    also ends if the history is dropped without being stopped, or if the
+    session of its listener is gone.
+    """
+    while True:
+        history = history_ref()
+        if history is None or history._stopped:
+            return
+        try:
+            history._drain_batch()
+        except ReferenceError:
+            return
+        except Exception, e:
+            logger.exception('Draining events failed')
+            history._fail(e)
+        del history
+
+
+class _Entry(object):
+    __slots__ = ('seq', 'timestamp', 'event', 'taken')
+
+    def __init__(self, seq, timestamp, event):
+        self.seq = seq
+        self.timestamp = timestamp
+        self.event = event
+        self.taken = False
+
+
+class EventHistory:
+    """Bounded history of the events of one HPI session.
+
+    A background thread takes the events from the session's event listener
+    and appends them to the history. Reading the history does not remove
+    events. Events returned by `wait` with `take` set are only marked, so
+    each event is handed out once to the event keywords, whereas state
+    waits may look at any event.
+
+    Events are indexed by their type, source resource and instrument
+    number. The oldest events are dropped if there are more than `size`
+    events or if they are older than `max_age` seconds. Events matching an
+    ignore rule are dropped by the background thread already, before any
+    callback sees them.
+    """
+
+    def __init__(self, listener, size=DEFAULT_HISTORY_SIZE, max_age=None,
+            callbacks=()):
+        # The listener belongs to the session, which must not be kept alive
+        # by its history.
+        self._listener = weakref.proxy(listener)
+        self._size = size
+        self._max_age = max_age
+        self._callbacks = list(callbacks)
+        self._entries = deque()
+        self._index = dict()
+        # Entries per key which may not be taken yet, so taking an event
+        # does not walk over the ones taken before.
+        self._untaken = dict()
+        self._seq = 0
+        self._cursor = 0
+        self._error = None
+        self._ignored = set()
+        self._dropped = dict()
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(target=_drain,
+                args=(weakref.ref(self),), name='HpiEventDrainer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Tells the background thread to stop without waiting for it.
+
+        Several histories are stopped quicker by calling `stop` on all of
+        them before calling `join`.
+        """
+        self._stopped = True
+
+    def join(self):
+        """Waits until the background thread stopped."""
+        if self._thread is not threading.current_thread():
+            self._thread.join(2 * DRAIN_TIMEOUT)
+
+    @property
+    def last_seq(self):
+        return self._seq
+
+    def add_callback(self, callback):
+        self._callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        self._callbacks.remove(callback)
+
+    def set_limits(self, size=None, max_age=None):
+        with self._cond:
+            self._size = size
+            self._max_age = max_age
+            self._evict()
+
+    def ignore(self, event_type=None, source=None):
+        """Drops all events of the given type and source from now on.
+
+        `None` matches any type or source.
+        """
+        with self._cond:
+            self._ignored.add((event_type, source))
+
+    def clear_ignored(self):
+        with self._cond:
+            self._ignored.clear()
+
+    def dropped(self):
+        """Returns the number of ignored events per event type."""
+        with self._cond:
+            return dict(self._dropped)
+
+    def _is_ignored(self, event):
+        """Called with the lock held."""
+        ignored = self._ignored
+        if not ignored:
+            return False
+        event_type = event.event_type
+        source = getattr(event, 'source', None)
+        return ((event_type, None) in ignored
+                or (event_type, source) in ignored
+                or (None, source) in ignored
+                or (None, None) in ignored)
+
+    def _take_batch(self):
+        """Waits for the next event of the listener and returns it
+        together with the events queued behind it."""
+        event = self._listener.get(timeout=DRAIN_TIMEOUT)
+        if event is None:
+            return []
+        events = [event]
+        while len(events) < DRAIN_BATCH_SIZE:
+            event = self._listener.get(timeout=0)
+            if event is None:
+                break
+            events.append(event)
+        return events
+
+    def _drain_batch(self):
+        try:
+            events = self._take_batch()
+        except hpi_errors.SaHpiError, e:
+            self._fail(e)
+            return
+        if events:
+            self.extend(events)
+
+    def _fail(self, error):
+        """Hands `error` to the next waiter and backs off."""
+        with self._cond:
+            self._error = error
+            self._cond.notify_all()
+        time.sleep(DRAIN_TIMEOUT)
+
+    def _run_callbacks(self, event):
+        # A failing callback must neither stop the drainer thread nor keep
+        # the event from the history.
+        for callback in self._callbacks:
+            try:
+                callback(event)
+            except Exception:
+                logger.exception('Event callback %r failed for %r',
+                        callback, event)
+
+    def append(self, event):
+        self.extend([event])
+
+    def extend(self, events):
+        kept = []
+        with self._cond:
+            for event in events:
+                if self._is_ignored(event):
+                    self._dropped[event.event_type] = \
+                            self._dropped.get(event.event_type, 0) + 1
+                else:
+                    kept.append(event)
+        if not kept:
+            return
+        # Callbacks may take a while, so they run without the lock.
+        for event in kept:
+            self._run_callbacks(event)
+        with self._cond:
+            timestamp = time.time()
+            for event in kept:
+                self._seq += 1
+                entry = _Entry(self._seq, timestamp, event)
+                self._entries.append(entry)
+                for key in _index_keys(event):
+                    self._index.setdefault(key, deque()).append(entry)
+                    self._untaken.setdefault(key, deque()).append(entry)
+            self._evict()
+            self._cond.notify_all()
+
+    def _evict(self):
+        entries = self._entries
+        if self._max_age is not None:
+            min_timestamp = time.time() - self._max_age
+        else:
+            min_timestamp = None
+        while entries and ((self._size is not None
+                and len(entries) > self._size)
+                or (min_timestamp is not None
+                    and entries[0].timestamp < min_timestamp)):
+            self._unindex(entries.popleft())
+
+    def _unindex(self, entry):
+        for key in _index_keys(entry.event):
+            for entries in (self._index, self._untaken):
+                index = entries.get(key)
+                if index and index[0] is entry:
+                    index.popleft()
+                if not index:
+                    entries.pop(key, None)
+
+    def _find_untaken(self, key, since):
+        untaken = self._untaken.get(key)
+        if not untaken:
+            return None
+        # Entries taken or cleared are never handed out again, so they are
+        # dropped from the front for good.
+        while untaken and (untaken[0].taken
+                or untaken[0].seq <= self._cursor):
+            untaken.popleft()
+        if not untaken:
+            del self._untaken[key]
+            return None
+        for entry in untaken:
+            if entry.seq > since and not entry.taken:
+                return entry
+        return None
+
+    def _find(self, key, since, take):
+        if take:
+            return self._find_untaken(key, since)
+        index = self._index.get(key)
+        if not index:
+            return None
+        # Waits for new events pass a recent sequence number, so walk the
+        # index from its newest end.
+        found = None
+        for entry in reversed(index):
+            if entry.seq <= since:
+                break
+            found = entry
+        return found
+
+    def wait(self, event_type, source=None, num=None, timeout=0,
+            since=0, take=False, may_fail=False):
+        """Returns the first event entry newer than `since` matching the
+        given type, source and instrument number.
+
+        Blocks up to `timeout` seconds if there is no such event yet.
+        Returns `None` if no event arrived in time.
+        """
+        key = (event_type, source, num)
+        end_time = time.time() + timeout
+        with self._cond:
+            while True:
+                if self._error is not None:
+                    error, self._error = self._error, None
+                    if not may_fail:
+                        raise error
+                self._evict()
+                entry = self._find(key, since, take)
+                if entry is not None:
+                    if take:
+                        entry.taken = True
+                    return entry
+                remaining = end_time - time.time()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+
+    def wait_newer(self, since, timeout):
+        """Blocks until there is any event newer than `since` or `timeout`
+        seconds passed and returns the latest sequence number."""
+        end_time = time.time() + timeout
+        with self._cond:
+            while self._seq <= since:
+                remaining = end_time - time.time()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return self._seq
+
+    def clear(self):
+        """Marks all events in the history as taken.
+
+        Returns the number of events which were not taken before per event
+        type.
+        """
+        with self._cond:
+            counts = dict()
+            # Entries are ordered by their sequence number, so only the
+            # ones after the cursor are looked at.
+            for entry in reversed(self._entries):
+                if entry.seq <= self._cursor:
+                    break
+                if not entry.taken:
+                    event_type = entry.event.event_type
+                    counts[event_type] = counts.get(event_type, 0) + 1
+            self._cursor = self._seq
+            return counts
+
+
+class RecordedEvent(object):
+    """Event read back from a recording."""
+
+    def __init__(self, attributes):
+        for name, value in attributes.items():
+            setattr(self, str(name), value)
+
+
+class EventRecorder:
+    """Appends events as JSON lines to a file.
+
+    Each line holds the time the event was received and all public
+    attributes of the event with a simple type.
+    """
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._file = open(path, 'ab', RECORDING_BUFFER_SIZE)
+
+    def record(self, event):
+        attributes = dict()
+        for name in dir(event):
+            if name.startswith('_'):
+                continue
+            value = getattr(event, name)
+            if isinstance(value, _RECORDED_TYPES):
+                attributes[name] = value
+        line = json.dumps(dict(received=time.time(), event=attributes))
+        with self._lock:
+            if self._file is not None:
+                self._file.write(line + '\n')
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class EventReplayer:
+    """Appends the events of a recording to an event history.
+
+    The events are replayed with their recorded spacing divided by `speed`.
+    If `speed` is 0, they are replayed as fast as possible.
+    """
+
+    def __init__(self, path, history, speed=1.0):
+        # Opened here, so a missing recording fails the calling keyword.
+        self._file = open(path, 'rb')
+        self._path = path
+        self._history = history
+        self._speed = speed
+        self._stopped = threading.Event()
+        self._error = None
+        self.count = 0
+        self._thread = threading.Thread(target=self._run,
+                name='HpiEventReplayer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        try:
+            self._replay()
+        except Exception:
+            self._error = sys.exc_info()
+        finally:
+            self._file.close()
+
+    def _replay(self):
+        start_time = time.time()
+        first = None
+        for num, line in enumerate(self._file, 1):
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+                received = float(entry['received'])
+                event = RecordedEvent(entry['event'])
+                event.event_type
+            except (ValueError, TypeError, KeyError, AttributeError), e:
+                raise RuntimeError('Invalid event in line %d of "%s": %s'
+                        % (num, self._path, e))
+            if first is None:
+                first = received
+            if self._speed:
+                due = start_time + (received - first) / self._speed
+                if self._stopped.wait(max(due - time.time(), 0)):
+                    return
+            elif self._stopped.is_set():
+                return
+            self._history.append(event)
+            self.count += 1
+
+    def join(self, timeout=None):
+        """Waits until all events are replayed and returns true, or false
+        on timeout.
+
+        An error which stopped the replay is raised again.
+        """
+        self._thread.join(timeout)
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error[0], error[1], error[2]
+        return not self._thread.is_alive()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
@@ -0,0 +1,234 @@
+# Copyright 2014 Kontron Europe GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""HTTP server for firmware images.
+
+Registered images are served to the targets for `Set Source`. Files are
+memory mapped and sent straight from the mapping, so the data is not
+copied through Python strings. Single byte ranges are supported for
+targets resuming a transfer, and each client is handled by its own
+thread. Transfer statistics are kept per client address.
+"""
+
+import mmap
+import os
+import socket
+import threading
+import time
+import urllib
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+CHUNK_SIZE = 256 * 1024
+
+def _parse_range(value, size):
+    """Returns the `(start, end)` of a `bytes=` range header, with `end`
+    being exclusive, or `None` if the range cannot be satisfied."""
+    unit, _, spec = value.partition('=')
+    if unit.strip() != 'bytes' or ',' in spec:
+        return None
+    first, _, last = spec.strip().partition('-')
+    try:
+        if not first:
+            # Suffix range, the last bytes of the file.
+            start = max(0, size - int(last))
+            end = size
+        else:
+            start = int(first)
+            end = min(size, int(last) + 1) if last else size
+    except ValueError:
+        return None
+    if start >= end:
+        return None
+    return start, end
+
+
+class _TransferStatistics(object):
+    __slots__ = ('requests', 'bytes', 'elapsed', 'errors', 'last_rate')
+
+    def __init__(self):
+        self.requests = 0
+        self.bytes = 0
+        self.elapsed = 0.0
+        self.errors = 0
+        self.last_rate = None
+
+    def add(self, sent, elapsed, failed):
+        self.requests += 1
+        self.bytes += sent
+        self.elapsed += elapsed
+        if failed:
+            self.errors += 1
+        if elapsed > 0:
+            self.last_rate = sent / elapsed
+
+    def as_dict(self):
+        return dict(requests=self.requests, bytes=self.bytes,
+                elapsed=self.elapsed, errors=self.errors,
+                rate=self.bytes / self.elapsed if self.elapsed else None,
+                last_rate=self.last_rate)
+
+
+class _ImageRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def _serve(self, send_body):
+        name = urllib.unquote(self.path.split('?', 1)[0].lstrip('/'))
+        path = self.server.image_server.image_path(name)
+        if path is None:
+            self.send_error(404)
+            return
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            start, end = 0, size
+            range_header = self.headers.getheader('Range')
+            if range_header is not None:
+                byte_range = _parse_range(range_header, size)
+                if byte_range is None:
+                    self.send_response(416)
+                    self.send_header('Content-Range', 'bytes */%d' % size)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                start, end = byte_range
+                self.send_response(206)
+                self.send_header('Content-Range',
+                        'bytes %d-%d/%d' % (start, end - 1, size))
+            else:
+                self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(end - start))
+            self.send_header('Accept-Ranges', 'bytes')
+            self.end_headers()
+            if send_body and end > start:
+                self._send_file(f, start, end)
+
+    def _send_file(self, f, start, end):
+        self.wfile.flush()
+        start_time = time.time()
+        sent = 0
+        failed = True
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            offset = start
+            while offset < end:
+                length = min(CHUNK_SIZE, end - offset)
+                self.connection.sendall(buffer(data, offset, length))
+                offset += length
+                sent += length
+            failed = False
+        except socket.error:
+            self.close_connection = 1
+        finally:
+            data.close()
+            self.server.image_server.record(self.client_address[0], sent,
+                    time.time() - start_time, failed)
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class ImageServer:
+    def __init__(self, host='', port=0, advertised_host=None):
+        self._server = _ThreadingHTTPServer((host, int(port)),
+                _ImageRequestHandler)
+        self._server.image_server = self
+        self._advertised_host = advertised_host or host or \
+                socket.gethostbyname(socket.gethostname())
+        self._lock = threading.Lock()
+        self._images = dict()
+        self._statistics = dict()
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                name='HpiImageServer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def register(self, path, name=None):
+        """Makes the file at `path` available as `name` and returns its
+        URI."""
+        path = os.path.abspath(path)
+        if not os.path.isfile(path):
+            raise RuntimeError('Image "%s" does not exist' % path)
+        if name is None:
+            name = os.path.basename(path)
+        with self._lock:
+            self._images[name] = path
+        return 'http://%s:%d/%s' % (self._advertised_host, self.port,
+                urllib.quote(name))
+
+    def unregister(self, name):
+        with self._lock:
+            self._images.pop(name, None)
+
+    def image_path(self, name):
+        with self._lock:
+            return self._images.get(name)
+
+    def record(self, client, sent, elapsed, failed):
+        with self._lock:
+            if client not in self._statistics:
+                self._statistics[client] = _TransferStatistics()
+            self._statistics[client].add(sent, elapsed, failed)
+
+    def statistics(self, reset=False):
+        """Returns the transfer statistics per client address."""
+        with self._lock:
+            statistics = dict((client, stats.as_dict())
+                    for client, stats in self._statistics.items())
+            if reset:
+                self._statistics.clear()
+        return statistics
+
+
+_server = None
+_server_lock = threading.Lock()
+
+def start(host='', port=0, advertised_host=None):
+    """Starts the process wide image server unless it is running already
+    and returns it."""
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = ImageServer(host, port, advertised_host)
+        return _server
+
+def stop():
+    global _server
+    with _server_lock:
+        if _server is not None:
+            _server.stop()
+            _server = None
+
+def server():
+    return _server
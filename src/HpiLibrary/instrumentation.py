@@ -0,0 +1,255 @@
+# Copyright 2014 Kontron Europe GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Timing of the pyhpi calls made by the library.
+
+Sessions are wrapped in proxies which time every method call, including
+those of the resources, FUMI/DIMI handlers, banks, tests and the event
+listener obtained through them. The statistics are process wide, so they
+cover all library instances and connections.
+"""
+
+import csv
+import json
+import threading
+import time
+from collections import deque
+
+# Number of latency samples kept per call for the percentiles.
+MAX_SAMPLES = 10000
+
+# Calls whose results are wrapped, too, and the kind of the result.
+_WRAPPED_RESULTS = {
+    'resources': 'resource',
+    'get_resources_by_entity_path': 'resource',
+    'fumi_handler_by_rdr': 'fumi',
+    'dimi_handler_by_rdr': 'dimi',
+    'logical_bank': 'bank',
+    'bank': 'bank',
+    'get_test_by_num': 'test',
+}
+
+# Attributes which are wrapped on access.
+_WRAPPED_ATTRIBUTES = {
+    'event_listener': 'listener',
+}
+
+def _percentile(sorted_samples, percent):
+    if not sorted_samples:
+        return None
+    index = int(round(percent / 100.0 * (len(sorted_samples) - 1)))
+    return sorted_samples[index]
+
+
+class _CallStatistics(object):
+    __slots__ = ('count', 'errors', 'total', 'max', 'samples')
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = deque(maxlen=MAX_SAMPLES)
+
+    def add(self, elapsed, failed):
+        self.count += 1
+        if failed:
+            self.errors += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+        self.samples.append(elapsed)
+
+    def as_dict(self):
+        samples = sorted(self.samples)
+        return dict(count=self.count, errors=self.errors, total=self.total,
+                mean=self.total / self.count if self.count else None,
+                p50=_percentile(samples, 50), p90=_percentile(samples, 90),
+                p99=_percentile(samples, 99), max=self.max)
+
+
+class Statistics:
+    """Call statistics per call and per (keyword, call).
+
+    The running keywords are tracked per thread, so calls made by
+    background threads are not charged to whatever keyword runs in the
+    main thread at the same time. See `attributed`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._calls = dict()
+
+    @property
+    def _keywords(self):
+        keywords = getattr(self._local, 'keywords', None)
+        if keywords is None:
+            keywords = self._local.keywords = []
+        return keywords
+
+    @property
+    def current_keyword(self):
+        if self._keywords:
+            return self._keywords[-1]
+        return None
+
+    def start_keyword(self, name):
+        self._keywords.append(name)
+
+    def end_keyword(self):
+        if self._keywords:
+            self._keywords.pop()
+
+    def attributed(self, func):
+        """Returns a wrapper of `func` which charges the calls made by
+        `func` to the keyword running in the calling thread, whichever
+        thread the wrapper runs in."""
+        keyword = self.current_keyword
+        def wrapper(*args):
+            self.start_keyword(keyword)
+            try:
+                return func(*args)
+            finally:
+                self.end_keyword()
+        return wrapper
+
+    def record(self, call, elapsed, failed):
+        keyword = self.current_keyword
+        with self._lock:
+            for key in ((None, call), (keyword, call)):
+                if key not in self._calls:
+                    self._calls[key] = _CallStatistics()
+                self._calls[key].add(elapsed, failed)
+
+    def reset(self):
+        with self._lock:
+            self._calls.clear()
+
+    def as_rows(self):
+        """Returns one dictionary per call and per keyword and call.
+
+        Rows with an empty `keyword` hold the totals of a call.
+        """
+        with self._lock:
+            items = [(k, v.as_dict()) for k, v in self._calls.items()]
+        rows = []
+        for (keyword, call), stats in sorted(items):
+            stats.update(keyword=keyword or '', call=call)
+            rows.append(stats)
+        return rows
+
+    def write(self, path):
+        """Writes the statistics to `path`, as CSV if the file name ends
+        with `.csv` and as JSON otherwise."""
+        rows = self.as_rows()
+        with open(path, 'wb') as f:
+            if path.lower().endswith('.csv'):
+                writer = csv.DictWriter(f, ['keyword', 'call', 'count',
+                        'errors', 'total', 'mean', 'p50', 'p90', 'p99',
+                        'max'])
+                writer.writeheader()
+                writer.writerows(rows)
+            else:
+                json.dump(rows, f, indent=2)
+
+
+class InstrumentedProxy(object):
+    """Wraps a pyhpi object and records the duration of each method call
+    as `kind.method`."""
+
+    def __init__(self, obj, statistics, kind):
+        self.__dict__['_obj'] = obj
+        self.__dict__['_statistics'] = statistics
+        self.__dict__['_kind'] = kind
+
+    def __getattr__(self, name):
+        attr = getattr(self._obj, name)
+        if name in _WRAPPED_ATTRIBUTES:
+            return wrap(attr, self._statistics, _WRAPPED_ATTRIBUTES[name])
+        if not callable(attr):
+            return attr
+        call = '%s.%s' % (self._kind, name)
+        result_kind = _WRAPPED_RESULTS.get(name)
+        statistics = self._statistics
+        def timed(*args, **kwargs):
+            start_time = time.time()
+            failed = True
+            try:
+                result = attr(*args, **kwargs)
+                failed = False
+            finally:
+                statistics.record(call, time.time() - start_time, failed)
+            if result_kind is not None:
+                result = wrap(result, statistics, result_kind)
+            return result
+        return timed
+
+    def __setattr__(self, name, value):
+        setattr(self._obj, name, value)
+
+    def __repr__(self):
+        return 'InstrumentedProxy(%r)' % (self._obj,)
+
+
+def wrap(obj, statistics, kind):
+    if obj is None:
+        return None
+    if isinstance(obj, list):
+        return [wrap(o, statistics, kind) for o in obj]
+    return InstrumentedProxy(obj, statistics, kind)
+
+def unwrap(obj):
+    """Returns the object wrapped by `wrap`, or `obj` if it is not
+    wrapped."""
+    if isinstance(obj, InstrumentedProxy):
+        return obj._obj
+    return obj
+
+
+_statistics = None
+_output = None
+
+def enable(output=None):
+    """Enables the instrumentation and returns the statistics.
+
+    If `output` is given, the statistics are written to that file at the end
+    of each suite.
+    """
+    global _statistics, _output
+    if _statistics is None:
+        _statistics = Statistics()
+    _output = output
+    return _statistics
+
+def statistics():
+    return _statistics
+
+
+class Listener:
+    """Library listener which tracks the running keyword and writes the
+    statistics at the end of each suite."""
+
+    ROBOT_LISTENER_API_VERSION = 2
+
+    def start_keyword(self, name, attrs):
+        if _statistics is not None:
+            _statistics.start_keyword(name)
+
+    def end_keyword(self, name, attrs):
+        if _statistics is not None:
+            _statistics.end_keyword()
+
+    def end_suite(self, name, attrs):
+        if _statistics is not None and _output is not None:
+            _statistics.write(_output)
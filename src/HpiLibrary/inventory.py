@@ -0,0 +1,166 @@
+# Copyright 2014 Kontron Europe GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import fnmatch
+import hashlib
+import json
+import weakref
+
+from utils import LazyModule
+
+sahpi = LazyModule('pyhpi.sahpi')
+
+class InventoryCache:
+    """Caches the RPT and RDR tables of one HPI session.
+
+    Resources are indexed by their entity path, RDRs by their ID string. A
+    lookup which misses the cache refreshes the corresponding table once
+    before giving up, so resources showing up later are found without
+    explicit invalidation.
+    """
+
+    def __init__(self, session):
+        # The cache is part of the state of the connection, which must not
+        # keep its session alive.
+        self._session = weakref.proxy(session)
+        self._resources = None
+        self._rdrs = dict()
+
+    def invalidate(self):
+        self._resources = None
+        self._rdrs = dict()
+
+    def event_seen(self, event):
+        if event.event_type in (sahpi.SAHPI_ET_RESOURCE,
+                sahpi.SAHPI_ET_HOTSWAP):
+            self.invalidate()
+
+    def _update_resources(self):
+        # The cache may be invalidated from the event drainer thread, so
+        # the tables are only replaced as a whole.
+        resources = dict()
+        for res in self._session.resources():
+            key = str(res.rpt.entity_path)
+            resources.setdefault(key, []).append(res)
+        self._rdrs = dict()
+        self._resources = resources
+        return resources
+
+    def resources(self):
+        resources = self._resources
+        if resources is None:
+            resources = self._update_resources()
+        return [res for l in resources.values() for res in l]
+
+    def resources_by_entity_path(self, ep):
+        key = str(ep)
+        resources = self._resources
+        if resources is not None and key in resources:
+            return resources[key]
+        return self._update_resources().get(key, [])
+
+    def resources_matching(self, pattern):
+        """Returns the resources whose entity path matches the shell style
+        `pattern`, ordered by entity path."""
+        resources = self._resources
+        if resources is None:
+            resources = self._update_resources()
+        return [res for key in sorted(fnmatch.filter(resources, pattern))
+                for res in resources[key]]
+
+    def _update_rdrs(self, res):
+        rdrs = dict()
+        for rdr in res.rdrs():
+            rdrs.setdefault(rdr.id_string, []).append(rdr)
+        self._rdrs[res.rpt.resource_id] = rdrs
+        return rdrs
+
+    def rdrs(self, res):
+        rdrs = self._rdrs.get(res.rpt.resource_id)
+        if rdrs is None:
+            rdrs = self._update_rdrs(res)
+        return [rdr for l in rdrs.values() for rdr in l]
+
+    def _lookup_rdr(self, rdrs, rdr_type, id):
+        for rdr in rdrs.get(id, ()):
+            if isinstance(rdr, rdr_type):
+                return rdr
+        return None
+
+    def find_rdr(self, res, rdr_type, id):
+        rdrs = self._rdrs.get(res.rpt.resource_id)
+        if rdrs is not None:
+            rdr = self._lookup_rdr(rdrs, rdr_type, id)
+            if rdr is not None:
+                return rdr
+        return self._lookup_rdr(self._update_rdrs(res), rdr_type, id)
+
+
+# Fields of an inventory record which are compared against a baseline.
+# Resource IDs are assigned by the daemon and may change between runs.
+COMPARED_FIELDS = ('product_id', 'manufacturer_id', 'rdrs')
+
+def iter_inventory(cache):
+    """Yields one record per resource of the cached inventory."""
+    for res in cache.resources():
+        info = res.rpt.resource_info
+        yield dict(entity_path=str(res.rpt.entity_path),
+                resource_id=res.rpt.resource_id,
+                product_id=info.product_id,
+                manufacturer_id=info.manufacturer_id,
+                rdrs=sorted([rdr.rdr_type, str(rdr.id_string)]
+                    for rdr in cache.rdrs(res)))
+
+def record_digest(record):
+    compared = [record.get(field) for field in COMPARED_FIELDS]
+    return hashlib.sha1(json.dumps(compared, sort_keys=True)).hexdigest()
+
+def write_inventory(records, path):
+    """Writes `records` as JSON lines and returns the number of records."""
+    count = 0
+    with open(path, 'wb') as f:
+        for record in records:
+            f.write(json.dumps(record, sort_keys=True))
+            f.write('\n')
+            count += 1
+    return count
+
+def read_inventory(path):
+    with open(path, 'rb') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def diff_inventory(records, baseline_path):
+    """Compares `records` against the baseline stored at `baseline_path`.
+
+    Returns three sorted lists: the entity paths missing in `records`, the
+    unexpected ones and the ones whose records differ.
+    """
+    baseline = dict()
+    for record in read_inventory(baseline_path):
+        baseline[record['entity_path']] = (record_digest(record), record)
+
+    unexpected = []
+    changed = []
+    for record in records:
+        ep = record['entity_path']
+        expected = baseline.pop(ep, None)
+        if expected is None:
+            unexpected.append(ep)
+        elif expected[0] != record_digest(record):
+            fields = [field for field in COMPARED_FIELDS
+                    if expected[1].get(field) != record.get(field)]
+            changed.append('%s (%s)' % (ep, ', '.join(fields)))
+    return sorted(baseline), sorted(unexpected), sorted(changed)
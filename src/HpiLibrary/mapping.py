@@ -12,34 +12,66 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import pyhpi.sahpi
+from robot.utils import normalizing
 
-from utils import find_attribute
+# Per prefix lookup tables, mapping normalized names to their values. They
+# are built on first use.
+_tables = dict()
+
+def _normalize(name):
+    return normalizing.normalize(name, ignore='_')
+
+def _lookup_table(prefix):
+    table = _tables.get(prefix)
+    if table is None:
+        import pyhpi.sahpi
+        table = dict()
+        normalized_prefix = _normalize(prefix)
+        for name in dir(pyhpi.sahpi):
+            normalized_name = _normalize(name)
+            if normalized_name.startswith(normalized_prefix):
+                table.setdefault(normalized_name,
+                        getattr(pyhpi.sahpi, name))
+        _tables[prefix] = table
+    return table
+
+def _find_attribute(attr, prefix):
+    attr = str(attr)
+    try:
+        return _lookup_table(prefix)[_normalize(prefix + attr)]
+    except KeyError:
+        pass
+
+    try:
+        attr = int(attr, 0)
+        return attr
+    except ValueError:
+        raise RuntimeError('Attribute "%s" in "pyhpi.sahpi" not found.'
+                % attr)
 
 def find_event_type(event_type):
-    return find_attribute(pyhpi.sahpi, event_type, 'SAHPI_ET_')
+    return _find_attribute(event_type, 'SAHPI_ET_')
 
 def find_fumi_access_protocol(proto):
-    return find_attribute(pyhpi.sahpi, proto, 'SAHPI_FUMI_PROT_')
+    return _find_attribute(proto, 'SAHPI_FUMI_PROT_')
 
 def find_fumi_capabilities(capabilities):
-    return find_attribute(pyhpi.sahpi, capabilities, 'SAHPI_FUMI_CAP_')
+    return _find_attribute(capabilities, 'SAHPI_FUMI_CAP_')
 
 def find_fumi_upgrade_state(state):
-    return find_attribute(pyhpi.sahpi, state, 'SAHPI_FUMI_')
+    return _find_attribute(state, 'SAHPI_FUMI_')
 
 def find_fumi_source_status(status):
-    return find_attribute(pyhpi.sahpi, status, 'SAHPI_FUMI_SRC_')
+    return _find_attribute(status, 'SAHPI_FUMI_SRC_')
 
 def find_dimi_test_service_impact(impact):
-    return find_attribute(pyhpi.sahpi, impact, 'SAHPI_DIMITEST_')
+    return _find_attribute(impact, 'SAHPI_DIMITEST_')
 
 def find_dimi_test_capabilities(capabilities):
-    return find_attribute(pyhpi.sahpi, capabilities,
-            'SAHPI_DIMITEST_CAPABILITY_')
+    return _find_attribute(capabilities, 'SAHPI_DIMITEST_CAPABILITY_')
 
 def find_dimi_test_status(status):
-    return find_attribute(pyhpi.sahpi, status, 'SAHPI_DIMITEST_STATUS_')
+    return _find_attribute(status, 'SAHPI_DIMITEST_STATUS_')
 
 def find_dimi_test_status_error(status):
-    return find_attribute(pyhpi.sahpi, status, 'SAHPI_DIMITEST_STATUSERR_')
+    return _find_attribute(status, 'SAHPI_DIMITEST_STATUSERR_')
@@ -0,0 +1,238 @@
+# Copyright 2014 Kontron Europe GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Process wide pool of open HPI sessions.
+
+Closing a pooled connection hands its session back to the pool instead of
+closing it, so the next suite connecting to the same daemon skips opening
+the session and attaching the event listener. Sessions which were idle for
+a while are checked before they are handed out again and those idle for
+too long are closed by a timer. Events received while a session was idle
+are dropped.
+
+Each acquired session is held by the owner given to `SessionPool.acquire`,
+and only that owner can hand it back, so a connection closed twice does
+not return a session which is in use by someone else again.
+"""
+
+import threading
+import time
+
+DEFAULT_MAX_IDLE = 300.0
+DEFAULT_CHECK_INTERVAL = 30.0
+
+def _close_quietly(session):
+    try:
+        session.close()
+    except Exception:
+        pass
+
+def _drain(listener):
+    """Drops the events left in the queue of `listener`."""
+    if listener is None:
+        return 0
+    count = 0
+    while listener.get(timeout=0) is not None:
+        count += 1
+    return count
+
+
+class SessionPool:
+    def __init__(self, max_idle=DEFAULT_MAX_IDLE,
+            check_interval=DEFAULT_CHECK_INTERVAL):
+        self.max_idle = max_idle
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._idle = dict()
+        self._in_use = dict()
+        self._timer = None
+        self._counts = dict(hits=0, misses=0, failed_checks=0, evicted=0)
+
+    def _count(self, name):
+        self._counts[name] += 1
+
+    def _expired(self, now, max_idle):
+        """Removes and returns the sessions idle for longer than
+        `max_idle`."""
+        expired = []
+        for key, idle in self._idle.items():
+            while idle and now - idle[0][0] >= max_idle:
+                expired.append(idle.pop(0)[1])
+                self._count('evicted')
+            if not idle:
+                del self._idle[key]
+        return expired
+
+    def _schedule_eviction(self):
+        """Starts the timer closing the oldest idle session once it is
+        expired. Called with the lock held."""
+        if self._timer is not None or not self._idle:
+            return
+        oldest = min(idle[0][0] for idle in self._idle.values())
+        self._timer = threading.Timer(
+                max(0, oldest + self.max_idle - time.time()), self._evict)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _cancel_eviction(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _evict(self):
+        with self._lock:
+            self._timer = None
+            expired = self._expired(time.time(), self.max_idle)
+            self._schedule_eviction()
+        for session in expired:
+            _close_quietly(session)
+
+    def _is_healthy(self, session):
+        try:
+            session.resources()
+            return True
+        except Exception:
+            return False
+
+    def acquire(self, host, port, open_session, owner):
+        """Returns an open session to `host` and `port` held by `owner`.
+
+        An idle session is reused if there is one, otherwise
+        `open_session(host, port)` is called.
+        """
+        key = (host, port)
+        while True:
+            now = time.time()
+            with self._lock:
+                expired = self._expired(now, self.max_idle)
+                idle = self._idle.get(key)
+                since, session = idle.pop() if idle else (None, None)
+            for old in expired:
+                _close_quietly(old)
+            if session is None:
+                break
+            if now - since <= self.check_interval or \
+                    self._is_healthy(session):
+                # Events received while the session was idle are not meant
+                # for the new connection.
+                _drain(getattr(session, 'event_listener', None))
+                with self._lock:
+                    self._count('hits')
+                    self._in_use[session] = (key, owner)
+                return session
+            with self._lock:
+                self._count('failed_checks')
+            _close_quietly(session)
+
+        session = open_session(host, port)
+        with self._lock:
+            self._count('misses')
+            self._in_use[session] = (key, owner)
+        return session
+
+    def _is_known(self, session):
+        """Called with the lock held."""
+        return session in self._in_use or any(s is session
+                for idle in self._idle.values() for _, s in idle)
+
+    def _take(self, session, owner):
+        """Removes and returns the key of `session` if it is held by
+        `owner`. Called with the lock held."""
+        key, holder = self._in_use.get(session, (None, None))
+        if key is None or holder is not owner:
+            return None
+        del self._in_use[session]
+        return key
+
+    def release(self, session, owner):
+        """Hands `session` held by `owner` back to the pool.
+
+        Sessions which are idle or held by another owner are left alone.
+        Returns false if the session is not known to this pool.
+        """
+        with self._lock:
+            key = self._take(session, owner)
+            if key is None:
+                return self._is_known(session)
+        _drain(getattr(session, 'event_listener', None))
+        now = time.time()
+        with self._lock:
+            expired = self._expired(now, self.max_idle)
+            self._idle.setdefault(key, []).append((now, session))
+            self._schedule_eviction()
+        for old in expired:
+            _close_quietly(old)
+        return True
+
+    def discard(self, session, owner):
+        """Closes `session` held by `owner` instead of handing it back to
+        the pool."""
+        with self._lock:
+            if self._take(session, owner) is None and \
+                    self._is_known(session):
+                return
+        _close_quietly(session)
+
+    def close_idle(self, max_idle=None):
+        """Closes the sessions idle for longer than `max_idle`, or all idle
+        sessions if it is not given. Returns the number of closed
+        sessions."""
+        with self._lock:
+            if max_idle is None:
+                expired = [s for idle in self._idle.values()
+                        for _, s in idle]
+                self._idle.clear()
+                self._cancel_eviction()
+            else:
+                expired = self._expired(time.time(), max_idle)
+        for session in expired:
+            _close_quietly(session)
+        return len(expired)
+
+    def statistics(self):
+        with self._lock:
+            statistics = dict(self._counts)
+            statistics.update(idle=sum(len(i) for i in self._idle.values()),
+                    in_use=len(self._in_use))
+        return statistics
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def enable(max_idle=DEFAULT_MAX_IDLE, check_interval=DEFAULT_CHECK_INTERVAL):
+    """Enables the pool, or changes its settings if it is enabled already,
+    and returns it."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = SessionPool(max_idle, check_interval)
+        else:
+            _pool.max_idle = max_idle
+            _pool.check_interval = check_interval
+        return _pool
+
+def disable():
+    """Disables the pool and closes all idle sessions.
+
+    Sessions in use are closed normally when their connection is closed.
+    """
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.close_idle()
+
+def pool():
+    return _pool
@@ -0,0 +1,131 @@
+# Copyright 2014 Kontron Europe GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import re
+import shutil
+import tempfile
+from array import array
+
+# Result strings longer than this are kept in a temporary file.
+SPILL_SIZE = 64 * 1024
+
+# Lines are separated by newlines only, whether the result string is kept
+# in memory or in a file. A carriage return before a newline is dropped
+# and a newline at the end does not start another line.
+
+def _strip_newline(line):
+    if line.endswith('\n'):
+        line = line[:-1]
+    if line.endswith('\r'):
+        line = line[:-1]
+    return line
+
+def _split_lines(text):
+    lines = text.split('\n')
+    if lines[-1] == '':
+        lines.pop()
+    return [_strip_newline(line) for line in lines]
+
+class TestResult(object):
+    """Results of a DIMI test run.
+
+    Long result strings are written to a temporary file together with an
+    index of the line offsets, so only the lines which are looked at are
+    read back. The file is removed by `close`.
+    """
+
+    def __init__(self, results, spill_size=SPILL_SIZE):
+        self.error_code = results.error_code
+        self.last_run_status = results.last_run_status
+        text = str(results.result)
+        self.size = len(text)
+        self.path = None
+        self._text = None
+        self._offsets = None
+        if self.size > spill_size:
+            self._spill(text)
+        else:
+            self._text = text
+
+    def _spill(self, text):
+        fd, self.path = tempfile.mkstemp(prefix='hpi-dimi-', suffix='.txt')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(text)
+        offsets = array('l', [0])
+        pos = text.find('\n')
+        while pos != -1 and pos + 1 < len(text):
+            offsets.append(pos + 1)
+            pos = text.find('\n', pos + 1)
+        self._offsets = offsets
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        if self.path is not None:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+            self.path = None
+
+    @property
+    def line_count(self):
+        if self._text is not None:
+            return len(_split_lines(self._text))
+        return len(self._offsets) if self.size else 0
+
+    def text(self):
+        if self._text is not None:
+            return self._text
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def equals(self, expected):
+        return len(expected) == self.size and self.text() == expected
+
+    def lines(self, first=0, last=None):
+        """Yields the lines `first` up to, but not including, `last`."""
+        if self._text is not None:
+            for line in _split_lines(self._text)[first:last]:
+                yield line
+            return
+        if last is None or last > self.line_count:
+            last = self.line_count
+        if first >= last:
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(self._offsets[first])
+            for _ in xrange(last - first):
+                yield _strip_newline(f.readline())
+
+    def search(self, pattern, max_matches=None):
+        """Returns `(line number, line)` of the lines matching the regular
+        expression `pattern`, counting lines from 1."""
+        regex = re.compile(pattern)
+        matches = []
+        for num, line in enumerate(self.lines(), 1):
+            if regex.search(line):
+                matches.append((num, line))
+                if max_matches is not None and len(matches) >= max_matches:
+                    break
+        return matches
+
+    def save(self, path):
+        if self._text is not None:
+            with open(path, 'wb') as f:
+                f.write(self._text)
+        else:
+            shutil.copyfile(self.path, path)
@@ -0,0 +1,461 @@
+# Copyright 2014 Kontron Europe GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""In-process stand-in for an OpenHPI session.
+
+The simulated session provides the subset of the pyhpi session API used by
+the library. Every call which would be a round-trip to the daemon is
+counted and can be delayed by a configurable latency. FUMI and DIMI
+operations walk through scripted state transitions and emit the
+corresponding events.
+
+The simulator is meant for developing suites and for benchmarking the
+library without a daemon, so its keywords are not part of `HpiLibrary`.
+Suites import `HpiLibrary.simulator.SimulatedHpiLibrary` instead, which
+has all keywords of `HpiLibrary` and the ones for simulated connections.
+"""
+
+import threading
+import time
+from Queue import Queue, Empty
+
+from robot.utils import timestr_to_secs
+
+from pyhpi import EntityPath, FumiRdr, DimiRdr
+from pyhpi.sahpi import (SAHPI_ET_FUMI, SAHPI_ET_DIMI, SAHPI_FUMI_RDR,
+        SAHPI_DIMI_RDR, SAHPI_SENSOR_RDR, SAHPI_FUMI_PROT_TFTP,
+        SAHPI_FUMI_CAP_ROLLBACK, SAHPI_FUMI_OPERATION_NOTSTARTED,
+        SAHPI_FUMI_SOURCE_VALIDATION_INITIATED,
+        SAHPI_FUMI_SOURCE_VALIDATION_DONE, SAHPI_FUMI_INSTALL_INITIATED,
+        SAHPI_FUMI_INSTALL_DONE, SAHPI_FUMI_ACTIVATE_INITIATED,
+        SAHPI_FUMI_ACTIVATE_DONE, SAHPI_FUMI_ROLLBACK_INITIATED,
+        SAHPI_FUMI_ROLLBACK_DONE, SAHPI_FUMI_SRC_VALIDATION_NOT_STARTED,
+        SAHPI_FUMI_SRC_VALID, SAHPI_DIMITEST_NONDEGRADING,
+        SAHPI_DIMITEST_PARAM_TYPE_INT32, SAHPI_DIMITEST_STATUS_NOT_RUN,
+        SAHPI_DIMITEST_STATUS_RUNNING, SAHPI_DIMITEST_STATUS_CANCELED,
+        SAHPI_DIMITEST_STATUS_FINISHED_NO_ERRORS,
+        SAHPI_DIMITEST_STATUSERR_NOERR)
+
+from HpiLibrary import HpiLibrary
+from mapping import find_fumi_upgrade_state
+
+# Initial and final upgrade state of each FUMI action.
+FUMI_ACTIONS = {
+    'validation': (SAHPI_FUMI_SOURCE_VALIDATION_INITIATED,
+            SAHPI_FUMI_SOURCE_VALIDATION_DONE),
+    'installation': (SAHPI_FUMI_INSTALL_INITIATED, SAHPI_FUMI_INSTALL_DONE),
+    'activation': (SAHPI_FUMI_ACTIVATE_INITIATED, SAHPI_FUMI_ACTIVATE_DONE),
+    'rollback': (SAHPI_FUMI_ROLLBACK_INITIATED, SAHPI_FUMI_ROLLBACK_DONE),
+}
+
+def _daemon_call(func):
+    def wrapper(self, *args, **kwargs):
+        self._session._call(func.__name__)
+        return func(self, *args, **kwargs)
+    wrapper.__name__ = func.__name__
+    wrapper.__doc__ = func.__doc__
+    return wrapper
+
+
+class _Record(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, ', '.join(
+                '%s=%r' % kv for kv in sorted(self.__dict__.items())))
+
+
+class Event(_Record):
+    pass
+
+
+class _Rdr(_Record):
+    pass
+
+
+class _FumiRdr(FumiRdr):
+    def __init__(self, id_string, fumi_num, num_banks):
+        self.rdr_type = SAHPI_FUMI_RDR
+        self.id_string = id_string
+        self.fumi_num = fumi_num
+        self.num_banks = num_banks
+        self.access_protocol = SAHPI_FUMI_PROT_TFTP
+        self.capability = SAHPI_FUMI_CAP_ROLLBACK
+
+
+class _DimiRdr(DimiRdr):
+    def __init__(self, id_string, dimi_num):
+        self.rdr_type = SAHPI_DIMI_RDR
+        self.id_string = id_string
+        self.dimi_num = dimi_num
+
+
+class EventListener:
+    def __init__(self):
+        self._queue = Queue()
+
+    def put(self, event):
+        self._queue.put(event)
+
+    def get(self, timeout=None):
+        try:
+            if timeout == 0:
+                return self._queue.get_nowait()
+            return self._queue.get(timeout=timeout)
+        except Empty:
+            return None
+
+
+class _Script:
+    """Runs a list of `(state, delay)` steps.
+
+    The current state is derived from the time passed since the start, so
+    no thread is needed to query it. Events for each step are emitted by
+    timers.
+    """
+
+    def __init__(self, initial):
+        self._steps = [(0, initial)]
+        self._start_time = time.time()
+        self._timers = []
+
+    def start(self, steps, emit):
+        self.cancel()
+        self._start_time = time.time()
+        self._steps = []
+        at = 0
+        for state, delay in steps:
+            at += delay
+            self._steps.append((at, state))
+            timer = threading.Timer(at, emit, (state,))
+            timer.daemon = True
+            timer.start()
+            self._timers.append(timer)
+
+    def cancel(self):
+        for timer in self._timers:
+            timer.cancel()
+        self._timers = []
+
+    def state(self):
+        elapsed = time.time() - self._start_time
+        current = self._steps[0][1]
+        for at, state in self._steps:
+            if at > elapsed:
+                break
+            current = state
+        return current
+
+    def progress(self):
+        if not self._steps or self._steps[-1][0] == 0:
+            return 100
+        elapsed = time.time() - self._start_time
+        return min(100, int(100 * elapsed / self._steps[-1][0]))
+
+
+class Bank:
+    def __init__(self, resource, fumi, num):
+        self._session = resource._session
+        self._resource = resource
+        self._fumi = fumi
+        self.num = num
+        self._source = None
+        self._script = _Script(SAHPI_FUMI_OPERATION_NOTSTARTED)
+
+    def _run(self, action):
+        steps = self._session.transitions[action]
+        self._script.start(steps, self._emit)
+
+    def _emit(self, state):
+        self._session.event_listener.put(Event(event_type=SAHPI_ET_FUMI,
+                source=self._resource.rpt.resource_id,
+                fumi_num=self._fumi.rdr.fumi_num, bank_num=self.num,
+                status=state, timestamp=time.time()))
+
+    @_daemon_call
+    def bank_info(self):
+        return _Record(size=self._session.bank_size,
+                identifier='bank%d' % self.num,
+                description='Simulated bank %d' % self.num,
+                date_time='2014-01-01', major_version=1, minor_version=0,
+                aux_version=self.num)
+
+    @_daemon_call
+    def source_info(self):
+        if self._source is None:
+            status = SAHPI_FUMI_SRC_VALIDATION_NOT_STARTED
+        else:
+            status = SAHPI_FUMI_SRC_VALID
+        return _Record(source_uri=self._source,
+                source_status=_Record(value=status))
+
+    @_daemon_call
+    def set_source(self, uri):
+        self._source = uri
+
+    @_daemon_call
+    def start_validation(self):
+        self._run('validation')
+
+    @_daemon_call
+    def start_installation(self):
+        self._run('installation')
+
+    @_daemon_call
+    def cancel(self):
+        self._script.start([(SAHPI_FUMI_OPERATION_NOTSTARTED, 0)],
+                self._emit)
+
+    @_daemon_call
+    def cleanup(self):
+        self._source = None
+        self._script.start([(SAHPI_FUMI_OPERATION_NOTSTARTED, 0)],
+                self._emit)
+
+    @_daemon_call
+    def status(self):
+        return self._script.state()
+
+
+class Fumi:
+    def __init__(self, resource, rdr):
+        self._session = resource._session
+        self.rdr = rdr
+        self._banks = [Bank(resource, self, n)
+                for n in range(rdr.num_banks + 1)]
+
+    def logical_bank(self):
+        return self._banks[0]
+
+    def bank(self, number):
+        return self._banks[number]
+
+    @_daemon_call
+    def start_activation(self):
+        self._banks[0]._run('activation')
+
+    @_daemon_call
+    def start_rollback(self):
+        self._banks[0]._run('rollback')
+
+
+class Test:
+    def __init__(self, resource, dimi, num):
+        self._session = resource._session
+        self._resource = resource
+        self._dimi = dimi
+        self.num = num
+        self.name = 'Test %d' % num
+        self.service_impact = SAHPI_DIMITEST_NONDEGRADING
+        self.capabilities = 0
+        self.parameters = [_Record(name='loops', description='Loops',
+                type=SAHPI_DIMITEST_PARAM_TYPE_INT32, default=1)]
+        self._script = _Script(SAHPI_DIMITEST_STATUS_NOT_RUN)
+
+    def _emit(self, status):
+        self._session.event_listener.put(Event(event_type=SAHPI_ET_DIMI,
+                source=self._resource.rpt.resource_id,
+                dimi_num=self._dimi.rdr.dimi_num, test_num=self.num,
+                run_status=status, timestamp=time.time()))
+
+    @_daemon_call
+    def start(self, parameters=None):
+        self._script.start([(SAHPI_DIMITEST_STATUS_RUNNING, 0),
+                (SAHPI_DIMITEST_STATUS_FINISHED_NO_ERRORS,
+                    self._session.test_time)], self._emit)
+
+    @_daemon_call
+    def cancel(self):
+        self._script.start([(SAHPI_DIMITEST_STATUS_CANCELED, 0)],
+                self._emit)
+
+    @_daemon_call
+    def status(self):
+        return (self._script.state(), self._script.progress())
+
+    @_daemon_call
+    def results(self):
+        return _Record(error_code=SAHPI_DIMITEST_STATUSERR_NOERR,
+                last_run_status=self._script.state(),
+                result='%s passed' % self.name)
+
+
+class Dimi:
+    def __init__(self, resource, rdr, num_tests):
+        self._session = resource._session
+        self.rdr = rdr
+        self._tests = [Test(resource, self, n) for n in range(num_tests)]
+
+    @_daemon_call
+    def get_test_by_num(self, number):
+        return self._tests[number]
+
+
+class Resource:
+    def __init__(self, session, resource_id, entity_path, num_rdrs):
+        self._session = session
+        self.rpt = _Record(resource_id=resource_id, entity_path=entity_path,
+                resource_info=_Record(product_id=0x1234,
+                    manufacturer_id=0x3a98))
+        fumi_rdr = _FumiRdr('FUMI', 0, 2)
+        dimi_rdr = _DimiRdr('DIMI', 0)
+        self._fumi = Fumi(self, fumi_rdr)
+        self._dimi = Dimi(self, dimi_rdr, 2)
+        self._rdrs = [fumi_rdr, dimi_rdr]
+        for num in range(max(0, num_rdrs - len(self._rdrs))):
+            self._rdrs.append(_Rdr(rdr_type=SAHPI_SENSOR_RDR,
+                    id_string='Sensor %d' % num, num=num))
+
+    @_daemon_call
+    def rdrs(self):
+        return list(self._rdrs)
+
+    def fumi_handler_by_rdr(self, rdr):
+        return self._fumi
+
+    def dimi_handler_by_rdr(self, rdr):
+        return self._dimi
+
+
+class Session:
+    """Simulated HPI session.
+
+    `resources` blades with `rdrs_per_resource` RDRs each are created. Each
+    of them has a FUMI with the ID string `FUMI` and two banks and a DIMI
+    with the ID string `DIMI` and two tests. Every call which needs a
+    round-trip to the daemon takes `latency` seconds, each FUMI phase
+    `phase_time` seconds and each DIMI test `test_time` seconds.
+    """
+
+    def __init__(self, resources=10, rdrs_per_resource=10, latency=0.0,
+            phase_time=1.0, test_time=1.0, bank_size=1024 * 1024):
+        self.latency = latency
+        self.test_time = test_time
+        self.bank_size = bank_size
+        self.calls = dict()
+        self.event_listener = None
+        self.transitions = dict()
+        for action, (initiated, done) in FUMI_ACTIONS.items():
+            self.transitions[action] = [(initiated, 0), (done, phase_time)]
+        self._session = self
+        self._lock = threading.Lock()
+        self._resources = []
+        for num in range(resources):
+            ep = EntityPath().from_string(
+                    '{SYSTEM_CHASSIS,1}{PHYSICAL_SLOT,%d}' % (num + 1))
+            self._resources.append(Resource(self, num + 1, ep,
+                    rdrs_per_resource))
+
+    def _call(self, name):
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    @_daemon_call
+    def open(self):
+        pass
+
+    @_daemon_call
+    def close(self):
+        pass
+
+    def attach_event_listener(self):
+        self.event_listener = EventListener()
+
+    @_daemon_call
+    def resources(self):
+        return list(self._resources)
+
+    @_daemon_call
+    def get_resources_by_entity_path(self, ep):
+        return [res for res in self._resources if res.rpt.entity_path == ep]
+
+
+class SimulatedHpiLibrary(HpiLibrary):
+    """`HpiLibrary` with additional keywords for simulated connections.
+
+    Example:
+    | Library | HpiLibrary.simulator.SimulatedHpiLibrary |
+    """
+
+    def open_simulated_hpi_connection(self, resources=10, rdrs_per_resource=10,
+            latency=0, phase_time='1 second', test_time='1 second',
+            alias=None):
+        """Opens a simulated HPI session which does not need a daemon.
+
+        The session contains `resources` resources with the entity paths
+        `{SYSTEM_CHASSIS,1}{PHYSICAL_SLOT,n}`, each having
+        `rdrs_per_resource` RDRs. Among them are a FUMI RDR with the ID
+        string `FUMI` and a DIMI RDR with the ID string `DIMI`.
+
+        Each call which would need a round-trip to the daemon takes
+        `latency`, each FUMI operation `phase_time` and each DIMI test
+        `test_time`. All times are given in Robot Framework's time format.
+
+        See `Set Simulated Upgrade Transitions` and `Get Simulated Call
+        Counts`.
+        """
+        session = self._instrument(Session(int(resources),
+                int(rdrs_per_resource), timestr_to_secs(latency),
+                timestr_to_secs(phase_time), timestr_to_secs(test_time)))
+        session.open()
+        session.attach_event_listener()
+        self._info('Opening simulated connection with %d resources',
+                int(resources))
+        return self._register_session(session, alias)
+
+    def _simulated_session(self):
+        if not hasattr(self._s, 'transitions'):
+            raise RuntimeError('Active connection is not simulated')
+        return self._s
+
+    def set_simulated_upgrade_transitions(self, action, *transitions):
+        """Sets the upgrade states a simulated FUMI action walks through.
+
+        `action` is one of `validation`, `installation`, `activation` or
+        `rollback`. Each transition is given in the form `state=delay`,
+        where `delay` is the time since the previous transition.
+
+        Example:
+        | Set Simulated Upgrade Transitions | installation | INSTALL_INITIATED=0 | INSTALL_FAILED_ROLLBACK_NEEDED=5s |
+        """
+        session = self._simulated_session()
+        if action not in session.transitions:
+            raise RuntimeError('Unknown action "%s"' % action)
+        steps = []
+        for transition in transitions:
+            try:
+                state, delay = transition.split('=', 1)
+            except ValueError:
+                raise RuntimeError('Transitions have to be in form of '
+                        '"state=delay"')
+            steps.append((find_fumi_upgrade_state(state),
+                    timestr_to_secs(delay)))
+        if not steps:
+            raise RuntimeError('At least one transition is needed')
+        session.transitions[action] = steps
+
+    def get_simulated_call_counts(self, reset=False):
+        """Returns a dictionary with the number of daemon calls made on the
+        simulated session, per call.
+
+        The counters are cleared if `reset` is given.
+        """
+        session = self._simulated_session()
+        counts = dict(session.calls)
+        if reset:
+            session.calls.clear()
+        return counts
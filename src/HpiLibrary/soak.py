@@ -0,0 +1,218 @@
+# Copyright 2014 Kontron Europe GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Repeated FUMI and DIMI cycles for soak tests.
+
+A soak run repeats a cycle of steps for a number of iterations or for a
+given time. Its memory use does not grow with the number of iterations:
+latencies go into histograms with fixed buckets, and per iteration records
+are only written to a metrics file, which is rotated when it gets too big.
+"""
+
+import json
+import os
+import threading
+import time
+
+# Upper bounds of the latency histogram buckets in seconds, from 1 ms to
+# about 2.3 hours. Slower steps are counted in an extra bucket.
+BUCKET_BOUNDS = tuple(0.001 * 2 ** i for i in range(24))
+
+DEFAULT_METRICS_SIZE = 10 * 1024 * 1024
+DEFAULT_METRICS_BACKUPS = 3
+
+class LatencyHistogram(object):
+    __slots__ = ('counts', 'count', 'total', 'min', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, elapsed):
+        index = 0
+        while index < len(BUCKET_BOUNDS) and elapsed > BUCKET_BOUNDS[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.total += elapsed
+        if self.min is None or elapsed < self.min:
+            self.min = elapsed
+        if self.max is None or elapsed > self.max:
+            self.max = elapsed
+
+    def percentile(self, percent):
+        """Returns the upper bound of the bucket holding the given
+        percentile."""
+        if not self.count:
+            return None
+        threshold = percent / 100.0 * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= threshold and count:
+                if index < len(BUCKET_BOUNDS):
+                    return min(BUCKET_BOUNDS[index], self.max)
+                return self.max
+        return self.max
+
+    def as_dict(self):
+        return dict(count=self.count, total=self.total,
+                mean=self.total / self.count if self.count else None,
+                min=self.min, max=self.max, p50=self.percentile(50),
+                p90=self.percentile(90), p99=self.percentile(99),
+                buckets=[(bound, count) for bound, count
+                    in zip(BUCKET_BOUNDS + (None,), self.counts) if count])
+
+
+class MetricsFile:
+    """Appends JSON lines to `path` and rotates it to `path.1`, `path.2`,
+    ... once it is larger than `max_size` bytes."""
+
+    def __init__(self, path, max_size=DEFAULT_METRICS_SIZE,
+            backups=DEFAULT_METRICS_BACKUPS):
+        self._path = path
+        self._max_size = max_size
+        self._backups = backups
+        self._file = open(path, 'ab')
+
+    def _rotate(self):
+        self._file.close()
+        for num in range(self._backups - 1, 0, -1):
+            old = '%s.%d' % (self._path, num)
+            if os.path.exists(old):
+                os.rename(old, '%s.%d' % (self._path, num + 1))
+        if self._backups > 0:
+            os.rename(self._path, '%s.1' % self._path)
+        else:
+            os.remove(self._path)
+        self._file = open(self._path, 'ab')
+
+    def write(self, record):
+        self._file.write(json.dumps(record, sort_keys=True))
+        self._file.write('\n')
+        self._file.flush()
+        if self._file.tell() > self._max_size:
+            self._rotate()
+
+    def close(self):
+        self._file.close()
+
+
+class SoakRun:
+    """Runs a cycle of steps repeatedly.
+
+    `steps` is a list of `(name, func)` tuples. Each `func` returns `None`
+    on success or a description of the failure. Exceptions count as
+    failures, too. A failed step ends its iteration. The run stops after
+    `iterations` iterations or after `duration` seconds, whichever comes
+    first, after more than `max_failures` failed iterations or when
+    `stop` is called.
+    """
+
+    def __init__(self, steps, iterations=None, duration=None,
+            max_failures=0, metrics=None):
+        self._steps = steps
+        self._iterations = iterations
+        self._duration = duration
+        self.max_failures = max_failures
+        self._metrics = metrics
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._done = threading.Event()
+        self.iteration = 0
+        self.failures = 0
+        self.last_failure = None
+        self.start_time = None
+        self.histograms = dict((name, LatencyHistogram())
+                for name, _ in steps)
+        self.histograms['iteration'] = LatencyHistogram()
+
+    def _should_continue(self):
+        if self._stopped.is_set():
+            return False
+        if self._iterations is not None and \
+                self.iteration >= self._iterations:
+            return False
+        if self._duration is not None and \
+                time.time() - self.start_time >= self._duration:
+            return False
+        return self.failures <= self.max_failures
+
+    def _run_iteration(self):
+        timings = dict()
+        error = None
+        start_time = time.time()
+        for name, func in self._steps:
+            step_start = time.time()
+            try:
+                error = func()
+            except Exception, e:
+                error = '%s: %s' % (e.__class__.__name__, e)
+            elapsed = time.time() - step_start
+            timings[name] = elapsed
+            with self._lock:
+                self.histograms[name].add(elapsed)
+            if error is not None:
+                error = '%s: %s' % (name, error)
+                break
+        elapsed = time.time() - start_time
+        with self._lock:
+            self.iteration += 1
+            self.histograms['iteration'].add(elapsed)
+            if error is not None:
+                self.failures += 1
+                self.last_failure = error
+        if self._metrics is not None:
+            self._metrics.write(dict(iteration=self.iteration,
+                    timestamp=start_time, elapsed=elapsed, steps=timings,
+                    error=error))
+
+    def start(self):
+        """Marks the run as running. Called by `run` unless it was called
+        before."""
+        if self.start_time is None:
+            self.start_time = time.time()
+
+    def run(self):
+        self.start()
+        try:
+            while self._should_continue():
+                self._run_iteration()
+        finally:
+            if self._metrics is not None:
+                self._metrics.close()
+            self._done.set()
+
+    def stop(self):
+        self._stopped.set()
+
+    def wait(self, timeout=None):
+        """Waits until the run is done. Returns false on timeout."""
+        return self._done.wait(timeout)
+
+    @property
+    def running(self):
+        return self.start_time is not None and not self._done.is_set()
+
+    def statistics(self):
+        with self._lock:
+            return dict(iterations=self.iteration, failures=self.failures,
+                    last_failure=self.last_failure, running=self.running,
+                    elapsed=time.time() - self.start_time
+                        if self.start_time is not None else 0,
+                    latencies=dict((name, h.as_dict())
+                        for name, h in self.histograms.items()))
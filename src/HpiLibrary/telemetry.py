@@ -0,0 +1,148 @@
+# Copyright 2014 Kontron Europe GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import threading
+import time
+from collections import deque
+
+from utils import LazyModule
+
+sahpi = LazyModule('pyhpi.sahpi')
+hpi_utils = LazyModule('pyhpi.utils')
+
+# Number of transitions kept per bank.
+MAX_TRANSITIONS = 1000
+
+# Upgrade state name prefixes and the phase they belong to.
+PHASES = (
+    ('SOURCE_VALIDATION', 'validation'),
+    ('INSTALL', 'installation'),
+    ('ACTIVATE', 'activation'),
+    ('ROLLBACK', 'rollback'),
+    ('BACKUP', 'backup'),
+    ('BANK_COPY', 'bank copy'),
+    ('TARGET_VERIFY', 'target verification'),
+)
+
+def _state_name(state):
+    name = hpi_utils.fumi_upgrade_status_str(state)
+    if name.startswith('SAHPI_FUMI_'):
+        name = name[len('SAHPI_FUMI_'):]
+    return name
+
+def _phase_of(name):
+    for prefix, phase in PHASES:
+        if name.startswith(prefix + '_'):
+            return prefix, phase
+    return None, None
+
+
+class UpgradeTelemetry:
+    """Records the upgrade state transitions of FUMI banks.
+
+    Transitions are keyed by `(resource id, FUMI number, bank number)` and
+    are fed from polled states as well as from FUMI events. From them, the
+    duration and outcome of each upgrade phase is derived.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._transitions = dict()
+        self._bank_sizes = dict()
+
+    def observe(self, key, state, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        name = _state_name(state)
+        with self._lock:
+            transitions = self._transitions.get(key)
+            if transitions is None:
+                transitions = deque(maxlen=MAX_TRANSITIONS)
+                self._transitions[key] = transitions
+            if transitions and transitions[-1][1] == name:
+                return
+            transitions.append((timestamp, name))
+
+    def event_seen(self, event):
+        if event.event_type != sahpi.SAHPI_ET_FUMI:
+            return
+        # Events replayed from a recording may lack some of the fields.
+        key = (getattr(event, 'source', None),
+                getattr(event, 'fumi_num', None),
+                getattr(event, 'bank_num', None))
+        status = getattr(event, 'status', None)
+        if None in key[1:] or status is None:
+            return
+        self.observe(key, status)
+
+    def set_bank_size(self, key, size):
+        self._bank_sizes[key] = size
+
+    def keys(self):
+        with self._lock:
+            return sorted(self._transitions)
+
+    def phases(self, key):
+        """Returns the upgrade phases of the given bank in order.
+
+        Each phase is a dictionary with the keys `phase`, `start`, `end`,
+        `duration` and `outcome`, the name of the state the phase ended
+        with. `end`, `duration` and `outcome` are `None` for a phase which
+        has not ended yet. Installations which are done also have a
+        `throughput` in bytes per second if the bank size is known.
+        """
+        with self._lock:
+            transitions = sorted(self._transitions.get(key, ()))
+        phases = []
+        current = None
+        for timestamp, name in transitions:
+            prefix, phase = _phase_of(name)
+            if current is not None and current['end'] is None and \
+                    current['phase'] != phase:
+                current.update(end=timestamp,
+                        duration=timestamp - current['start'])
+            if phase is None:
+                current = None
+                continue
+            if current is None or current['phase'] != phase or \
+                    current['end'] is not None:
+                current = dict(phase=phase, start=timestamp, end=None,
+                        duration=None, outcome=None)
+                phases.append(current)
+            if name != prefix + '_INITIATED':
+                current.update(end=timestamp, outcome=name,
+                        duration=timestamp - current['start'])
+
+        size = self._bank_sizes.get(key)
+        for phase in phases:
+            if (phase['phase'] == 'installation' and size and
+                    phase['outcome'] == 'INSTALL_DONE' and phase['duration']):
+                phase['throughput'] = size / phase['duration']
+        return phases
+
+    def write(self, path, entity_paths):
+        """Appends one JSON line per phase of all banks to `path`.
+
+        `entity_paths` maps resource IDs to entity paths.
+        """
+        with open(path, 'ab') as f:
+            for key in self.keys():
+                resource_id, fumi_num, bank_num = key
+                for phase in self.phases(key):
+                    phase.update(resource_id=resource_id,
+                            entity_path=entity_paths.get(resource_id),
+                            fumi_num=fumi_num, bank_num=bank_num)
+                    f.write(json.dumps(phase, sort_keys=True))
+                    f.write('\n')
@@ -12,22 +12,28 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from robot.utils import normalizing
+import sys
+import threading
+import weakref
+from collections import deque
 
-def find_attribute(obj, attr, prefix):
-    attr = str(attr)
-    for i_attr in dir(obj):
-        normalized_i_attr = normalizing.normalize(i_attr, ignore='_')
-        normalized_attr = normalizing.normalize(prefix + attr,
-                ignore='_')
-        if normalized_i_attr == normalized_attr:
-            return getattr(obj, i_attr)
+class LazyModule(object):
+    """Stand-in for a module which is imported on first attribute
+    access."""
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        __import__(self._name)
+        value = getattr(sys.modules[self._name], attr)
+        # Later lookups of the same attribute do not end up here.
+        setattr(self, attr, value)
+        return value
+
+    def __repr__(self):
+        return '<lazy module %r>' % self._name
 
-    try:
-        attr = int(attr, 0)
-        return attr
-    except ValueError:
-        raise RuntimeError('Attribute "%s" in "%s" not found.' % (attr, obj))
 
 def int_any_base(i, base=0):
     try:
@@ -37,43 +43,238 @@ def int_any_base(i, base=0):
     except ValueError:
         raise RuntimeError('Could not parse integer "%s"' % i)
 
+def _slots_of(cls):
+    slots = []
+    for c in reversed(cls.__mro__):
+        for name in c.__dict__.get('__slots__', ()):
+            if name not in ('__weakref__', '_release_hooks'):
+                slots.append(name)
+    return tuple(slots)
+
+_PROXY_TYPES = (weakref.ProxyType, weakref.CallableProxyType)
+
+def approximate_size(obj, seen):
+    """Returns the approximate memory size of `obj` and all containers,
+    instances and slots reachable from it, in bytes.
+
+    Objects whose `id` is in `seen` are skipped, so shared objects are only
+    counted once. Weak references are not followed, as they usually point
+    to objects owned by someone else, like the session.
+    """
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj, 0)
+    # Proxies pretend to be of the type of their referent, so their real
+    # type has to be checked first.
+    if type(obj) in _PROXY_TYPES or isinstance(obj, weakref.ReferenceType):
+        return size
+    if isinstance(obj, dict):
+        for key, value in obj.iteritems():
+            size += approximate_size(key, seen) + approximate_size(value, seen)
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+        for item in obj:
+            size += approximate_size(item, seen)
+    else:
+        if hasattr(obj, '__dict__') and not isinstance(obj, type):
+            size += approximate_size(obj.__dict__, seen)
+        for name in getattr(type(obj), '__slots__', ()):
+            if hasattr(obj, name):
+                size += approximate_size(getattr(obj, name), seen)
+    return size
+
+
+class ConnectionState(object):
+    """Compact state of one connection.
+
+    Subclasses list the valid keys in `__slots__`. The state is accessed
+    like a dictionary, unset keys are missing. Functions registered with
+    `add_release_hook` are called in reverse order when the connection is
+    released.
+    """
+
+    __slots__ = ('_release_hooks',)
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        try:
+            setattr(self, key, value)
+        except AttributeError:
+            raise KeyError('Unknown connection state "%s"' % key)
+
+    def __delitem__(self, key):
+        try:
+            delattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return hasattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def pop(self, key, default=None):
+        value = getattr(self, key, default)
+        if hasattr(self, key):
+            delattr(self, key)
+        return value
+
+    def setdefault(self, key, default=None):
+        if not hasattr(self, key):
+            self[key] = default
+        return getattr(self, key)
+
+    def keys(self):
+        return [key for key in _slots_of(type(self)) if hasattr(self, key)]
+
+    def items(self):
+        return [(key, getattr(self, key)) for key in self.keys()]
+
+    def add_release_hook(self, func):
+        if not hasattr(self, '_release_hooks'):
+            self._release_hooks = []
+        self._release_hooks.append(func)
+
+    def remove_release_hook(self, func):
+        if func in getattr(self, '_release_hooks', ()):
+            self._release_hooks.remove(func)
+
+    def release(self):
+        hooks = self.pop('_release_hooks', None) or []
+        for func in reversed(hooks):
+            func()
+        for key in self.keys():
+            delattr(self, key)
+
+
 class PerConnectionStorage:
-    def __init__(self, propname):
+    """Storage of state per connection.
+
+    The state of a connection is an instance of `state_class`. Connections
+    are weakly referenced, so objects kept in the state must not reference
+    the connection strongly. The state should still be released with
+    `_cp_release` when a connection is closed.
+    """
+
+    def __init__(self, propname, state_class=dict):
         self._cp_propname = propname
-        self._cp_storage = dict()
+        self._cp_state_class = state_class
+        self._cp_storage = weakref.WeakKeyDictionary()
+        self._cp_local = threading.local()
 
     @property
     def _cp(self):
         """Property storage per connection."""
+        state = getattr(self._cp_local, 'state', None)
+        if state is not None:
+            return state
         if not hasattr(self, self._cp_propname):
             raise RuntimeError('No/wrong active connection property set.')
         active_connection = getattr(self, self._cp_propname)
         if active_connection is None:
             raise RuntimeError('No connection active')
-        if active_connection not in self._cp_storage:
-            self._cp_storage[active_connection] = dict()
-        return self._cp_storage[active_connection]
+        state = self._cp_storage.get(active_connection)
+        if state is None:
+            # Threads using the same connection get the same state.
+            state = self._cp_storage.setdefault(active_connection,
+                    self._cp_state_class())
+        return state
 
+    def _cp_set_local(self, state):
+        """Makes `_cp` return `state` in the calling thread, or the state
+        of the active connection again if `state` is `None`."""
+        self._cp_local.state = state
+
+    def _cp_release(self, connection):
+        """Runs the release hooks of `connection` and drops its state."""
+        state = self._cp_storage.pop(connection, None)
+        if state is not None and hasattr(state, 'release'):
+            state.release()
+
+
+# Per thread counter of nested `Logging._quietly` calls.
+_quiet = threading.local()
 
 class Logging:
+    """Logging helpers.
+
+    Messages are only formatted if their level is enabled in Robot
+    Framework, so arguments should be passed separately from the format
+    string.
+    """
+
+    _default_log_level = 'INFO'
+
+    _LOG_LEVELS = {'TRACE': 0, 'DEBUG': 1, 'INFO': 2, 'HTML': 2, 'WARN': 3,
+            'NONE': 4}
+
     def _warn(self, fmt, *args):
-        self._log_format(fmt, level='WARN')
+        self._log_format(fmt, *args, level='WARN')
 
     def _info(self, fmt, *args):
-        self._log_format(fmt, level='INFO')
+        self._log_format(fmt, *args, level='INFO')
 
     def _debug(self, fmt, *args):
-        self._log_format(fmt, level='DEBUG')
+        self._log_format(fmt, *args, level='DEBUG')
 
     def _trace(self, fmt, *args):
-        self._log_format(fmt, level='TRACE')
+        self._log_format(fmt, *args, level='TRACE')
+
+    def _debug_lines(self, title, lines):
+        """Logs `title` and all `lines` as one debug message.
+
+        `lines` may be a generator, which is only consumed if debug
+        messages are logged.
+        """
+        if not self._is_log_level_enabled('DEBUG'):
+            return
+        self._log('\n  '.join([title] + [str(l) for l in lines]),
+                level='DEBUG')
+
+    def _quietly(self, func, *args):
+        """Calls `func(*args)` with all log messages of the calling thread
+        dropped.
+
+        Used for work shared by worker threads and the calling thread, so
+        none of the tasks is logged, whichever thread runs it.
+        """
+        _quiet.depth = getattr(_quiet, 'depth', 0) + 1
+        try:
+            return func(*args)
+        finally:
+            _quiet.depth -= 1
+
+    def _is_log_level_enabled(self, level):
+        # Robot Framework cannot assign messages written by other threads
+        # to a keyword, so they are dropped.
+        if threading.current_thread().name != 'MainThread':
+            return False
+        if getattr(_quiet, 'depth', 0):
+            return False
+        from robot.libraries.BuiltIn import BuiltIn, RobotNotRunningError
+        try:
+            threshold = BuiltIn().get_variable_value('${LOG LEVEL}', 'TRACE')
+        except RobotNotRunningError:
+            return True
+        return (self._LOG_LEVELS.get(level.upper(), 0)
+                >= self._LOG_LEVELS.get(threshold.upper(), 0))
 
     def _log_format(self, fmt, *args, **kwargs):
         level=None
         if 'level' in kwargs:
             level=kwargs['level']
 
-        self._log(fmt % args, level=level)
+        if not self._is_log_level_enabled(level or self._default_log_level):
+            return
+        if args:
+            fmt = fmt % args
+        self._log(fmt, level=level)
 
     def _log(self, msg, level=None):
         self._is_valid_log_level(level, raise_if_invalid=True)
@@ -0,0 +1,103 @@
+# Copyright 2014 Kontron Europe GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Combined waits for several conditions.
+
+All conditions share one schedule ordered by the time of their next poll
+and one polling interval, which backs off exponentially while nothing
+happens. A condition is polled again right away when an event matching
+its event key arrives.
+"""
+
+import heapq
+import time
+
+class Condition(object):
+    """Condition polled by `wait_for_conditions`.
+
+    `poll` returns true once the condition holds. `event_key` is the tuple
+    of event type, source resource and instrument number of the events
+    which may change the outcome of `poll`.
+    """
+
+    def __init__(self, name, poll, event_key=None):
+        self.name = name
+        self.poll = poll
+        self.event_key = event_key
+        self.elapsed = None
+        self._due = None
+
+    @property
+    def finished(self):
+        return self.elapsed is not None
+
+
+def wait_for_conditions(events, conditions, timeout, min_interval,
+        max_interval, wait_for_all=True):
+    """Polls `conditions` until all of them, or any of them if
+    `wait_for_all` is false, hold or `timeout` seconds passed.
+
+    The time it took until each condition held is stored in its `elapsed`
+    attribute. Returns true if the combined condition holds.
+    """
+    start_time = time.time()
+    end_time = start_time + timeout
+    since = events.last_seq
+    interval = min_interval
+    schedule = []
+    pending = set(conditions)
+
+    def schedule_poll(condition, due):
+        condition._due = due
+        heapq.heappush(schedule, (due, id(condition), condition))
+
+    for condition in conditions:
+        schedule_poll(condition, start_time)
+
+    while True:
+        now = time.time()
+        progressed = False
+        while schedule and schedule[0][0] <= now:
+            due, _, condition = heapq.heappop(schedule)
+            if condition not in pending or due != condition._due:
+                # Rescheduled in the meantime.
+                continue
+            if condition.poll():
+                condition.elapsed = time.time() - start_time
+                pending.discard(condition)
+                progressed = True
+                if not wait_for_all:
+                    return True
+            else:
+                schedule_poll(condition, now + interval)
+        if not pending:
+            return True
+        if now >= end_time:
+            return False
+        if progressed:
+            interval = min_interval
+        else:
+            interval = min(interval * 2, max_interval)
+
+        next_due = min(schedule[0][0], end_time)
+        last_seq = events.wait_newer(since, max(0, next_due - now))
+        if last_seq != since:
+            now = time.time()
+            for condition in pending:
+                if condition.event_key is not None and events.wait(
+                        *condition.event_key, since=since,
+                        may_fail=True) is not None:
+                    schedule_poll(condition, now)
+            since = last_seq
+            interval = min_interval
@@ -0,0 +1,191 @@
+# Copyright 2014 Kontron Europe GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from HpiLibrary.events import EventHistory
+from HpiLibrary.simulator import Event, EventListener
+
+FUMI = 10
+DIMI = 11
+
+logging.getLogger('HpiLibrary.events').addHandler(logging.NullHandler())
+
+def _event(event_type=FUMI, source=1, **kwargs):
+    return Event(event_type=event_type, source=source, **kwargs)
+
+
+class _FailingListener(EventListener):
+    def __init__(self, error):
+        EventListener.__init__(self)
+        self._failure = error
+
+    def get(self, timeout=None):
+        error, self._failure = self._failure, None
+        if error is not None:
+            raise error
+        return EventListener.get(self, timeout)
+
+
+class EventHistoryTest(unittest.TestCase):
+    def setUp(self):
+        self.listener = EventListener()
+        self.history = EventHistory(self.listener)
+
+    def tearDown(self):
+        self.history.stop()
+        self.history.join()
+
+    def test_taken_events_are_handed_out_once(self):
+        first, second = _event(), _event()
+        self.history.extend([first, second])
+        self.assertTrue(self.history.wait(FUMI, take=True).event is first)
+        self.assertTrue(self.history.wait(FUMI, take=True).event is second)
+        self.assertEqual(self.history.wait(FUMI, take=True), None)
+
+    def test_taken_events_are_still_seen_by_state_waits(self):
+        self.history.append(_event())
+        self.history.wait(FUMI, take=True)
+        self.assertNotEqual(self.history.wait(FUMI, source=1), None)
+
+    def test_take_by_source_skips_other_sources(self):
+        other, wanted = _event(source=1), _event(source=2)
+        self.history.extend([other, wanted])
+        entry = self.history.wait(FUMI, source=2, take=True)
+        self.assertTrue(entry.event is wanted)
+        self.assertTrue(self.history.wait(FUMI, take=True).event is other)
+
+    def test_events_from_the_listener_are_drained(self):
+        self.listener.put(_event(DIMI))
+        self.assertNotEqual(self.history.wait(DIMI, timeout=2, take=True),
+                None)
+
+    def test_clear_counts_untaken_events(self):
+        self.history.extend([_event(), _event(), _event(DIMI)])
+        self.history.wait(FUMI, take=True)
+        self.assertEqual(self.history.clear(), {FUMI: 1, DIMI: 1})
+        self.assertEqual(self.history.clear(), {})
+
+    def test_wait_after_clear_only_sees_newer_events(self):
+        self.history.append(_event())
+        self.history.clear()
+        self.assertEqual(self.history.wait(FUMI, take=True), None)
+        newer = _event()
+        self.history.append(newer)
+        self.assertTrue(self.history.wait(FUMI, take=True).event is newer)
+
+    def test_eviction_by_size(self):
+        self.history.set_limits(size=2)
+        events = [_event(num=num) for num in range(3)]
+        self.history.extend(events)
+        self.assertTrue(self.history.wait(FUMI, take=True).event
+                is events[1])
+        self.assertTrue(self.history.wait(FUMI, take=True).event
+                is events[2])
+        self.assertEqual(self.history.wait(FUMI, take=True), None)
+
+    def test_eviction_by_age(self):
+        self.history.set_limits(max_age=0.05)
+        self.history.append(_event())
+        time.sleep(0.1)
+        newer = _event()
+        self.history.append(newer)
+        self.assertTrue(self.history.wait(FUMI, take=True).event is newer)
+        self.assertEqual(self.history.wait(FUMI, take=True), None)
+
+    def test_failing_callback_keeps_the_drainer_running(self):
+        def fail(event):
+            raise ValueError('callback failed')
+        seen = []
+        self.history.add_callback(fail)
+        self.history.add_callback(seen.append)
+        self.listener.put(_event())
+        self.assertNotEqual(self.history.wait(FUMI, timeout=2, take=True),
+                None)
+        self.listener.put(_event(DIMI))
+        self.assertNotEqual(self.history.wait(DIMI, timeout=2, take=True),
+                None)
+        self.assertEqual(len(seen), 2)
+        self.assertTrue(self.history._thread.is_alive())
+
+    def test_ignore_all_events(self):
+        self.history.ignore()
+        self.history.extend([_event(), _event(DIMI, source=2)])
+        self.assertEqual(self.history.wait(FUMI), None)
+        self.assertEqual(self.history.wait(DIMI), None)
+        self.assertEqual(self.history.dropped(), {FUMI: 1, DIMI: 1})
+
+    def test_ignore_by_type(self):
+        self.history.ignore(FUMI)
+        dimi = _event(DIMI)
+        self.history.extend([_event(), dimi, _event(source=2)])
+        self.assertEqual(self.history.wait(FUMI), None)
+        self.assertTrue(self.history.wait(DIMI, take=True).event is dimi)
+        self.assertEqual(self.history.dropped(), {FUMI: 2})
+
+    def test_ignore_by_type_and_source(self):
+        self.history.ignore(FUMI, 1)
+        kept = [_event(source=2), _event(DIMI, source=1)]
+        self.history.extend([_event(source=1)] + kept)
+        self.assertTrue(self.history.wait(FUMI, take=True).event is kept[0])
+        self.assertTrue(self.history.wait(DIMI, take=True).event is kept[1])
+        self.assertEqual(self.history.dropped(), {FUMI: 1})
+
+    def test_ignore_by_source(self):
+        self.history.ignore(source=1)
+        kept = _event(DIMI, source=2)
+        self.history.extend([_event(source=1), _event(DIMI, source=1), kept])
+        self.assertTrue(self.history.wait(DIMI, take=True).event is kept)
+        self.assertEqual(self.history.wait(FUMI), None)
+        self.assertEqual(self.history.dropped(), {FUMI: 1, DIMI: 1})
+
+    def test_ignored_events_skip_callbacks(self):
+        seen = []
+        self.history.add_callback(seen.append)
+        self.history.ignore(FUMI)
+        dimi = _event(DIMI)
+        self.history.extend([_event(), dimi])
+        self.assertEqual(seen, [dimi])
+
+    def test_clear_ignored_keeps_dropped_counts(self):
+        self.history.ignore()
+        self.history.append(_event())
+        self.history.clear_ignored()
+        newer = _event()
+        self.history.append(newer)
+        self.assertTrue(self.history.wait(FUMI, take=True).event is newer)
+        self.assertEqual(self.history.dropped(), {FUMI: 1})
+
+
+class DrainerFailureTest(unittest.TestCase):
+    def test_drainer_errors_are_raised_by_the_next_wait(self):
+        listener = _FailingListener(RuntimeError('listener failed'))
+        history = EventHistory(listener)
+        try:
+            self.assertRaises(RuntimeError, history.wait, FUMI, timeout=2)
+            listener.put(_event())
+            self.assertNotEqual(history.wait(FUMI, timeout=2), None)
+        finally:
+            history.stop()
+            history.join()
+
+
+if __name__ == '__main__':
+    unittest.main()
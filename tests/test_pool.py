@@ -0,0 +1,135 @@
+# Copyright 2014 Kontron Europe GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+import unittest
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from HpiLibrary import pool
+from HpiLibrary.simulator import Session, SimulatedHpiLibrary
+
+def _open_session(host, port):
+    session = Session(resources=1, rdrs_per_resource=2)
+    session.open()
+    session.attach_event_listener()
+    return session
+
+
+class SessionPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = pool.SessionPool()
+        self.first, self.second = object(), object()
+
+    def tearDown(self):
+        self.pool.close_idle()
+
+    def _acquire(self, owner):
+        return self.pool.acquire('shmm', 4743, _open_session, owner)
+
+    def test_released_session_is_reused(self):
+        session = self._acquire(self.first)
+        self.assertTrue(self.pool.release(session, self.first))
+        self.assertTrue(self._acquire(self.second) is session)
+        statistics = self.pool.statistics()
+        self.assertEqual((statistics['hits'], statistics['misses']), (1, 1))
+
+    def test_unknown_session_is_not_released(self):
+        self.assertFalse(self.pool.release(_open_session('shmm', 4743),
+                self.first))
+
+    def test_double_release_keeps_one_idle_session(self):
+        session = self._acquire(self.first)
+        self.assertTrue(self.pool.release(session, self.first))
+        self.assertTrue(self.pool.release(session, self.first))
+        self.assertEqual(self.pool.statistics()['idle'], 1)
+
+    def test_release_by_other_owner_is_ignored(self):
+        session = self._acquire(self.first)
+        self.pool.release(session, self.first)
+        self.assertTrue(self._acquire(self.second) is session)
+        # A late second release of the first owner must not hand the
+        # session to a third one.
+        self.assertTrue(self.pool.release(session, self.first))
+        statistics = self.pool.statistics()
+        self.assertEqual((statistics['idle'], statistics['in_use']), (0, 1))
+        self.assertFalse(self._acquire(object()) is session)
+
+    def test_discard_by_other_owner_is_ignored(self):
+        session = self._acquire(self.first)
+        self.pool.discard(session, self.second)
+        self.assertEqual(self.pool.statistics()['in_use'], 1)
+        self.pool.discard(session, self.first)
+        self.assertEqual(self.pool.statistics()['in_use'], 0)
+
+
+class _PooledLibrary(SimulatedHpiLibrary):
+    def _new_session(self, host, port):
+        return _open_session(host, port)
+
+
+class ConnectionPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = pool.enable()
+        self._stdout, sys.stdout = sys.stdout, StringIO()
+
+    def tearDown(self):
+        sys.stdout = self._stdout
+        pool.disable()
+
+    def test_closed_connection_is_removed(self):
+        lib = _PooledLibrary()
+        lib.open_hpi_connection('shmm', alias='first')
+        lib.close_hpi_connection()
+        self.assertRaises(RuntimeError, lib.entity_path_should_exist,
+                '{SYSTEM_CHASSIS,1}')
+        lib.switch_hpi_connection('first')
+        self.assertRaises(RuntimeError, lib.entity_path_should_exist,
+                '{SYSTEM_CHASSIS,1}')
+        # Closing again does nothing.
+        lib.close_hpi_connection()
+        self.assertEqual(self.pool.statistics()['idle'], 1)
+
+    def test_close_all_does_not_release_session_of_other_library(self):
+        first, second, third = _PooledLibrary(), _PooledLibrary(), \
+                _PooledLibrary()
+        first.open_hpi_connection('shmm')
+        session = first._s
+        first.close_hpi_connection()
+        second.open_hpi_connection('shmm')
+        self.assertTrue(second._s is session)
+        first.close_all_hpi_connections()
+        third.open_hpi_connection('shmm')
+        self.assertFalse(third._s is session)
+        second.close_all_hpi_connections()
+        third.close_all_hpi_connections()
+        self.assertEqual(self.pool.statistics()['in_use'], 0)
+
+    def test_reused_session_drops_old_index(self):
+        lib = _PooledLibrary()
+        lib.open_hpi_connection('shmm')
+        session = lib._s
+        lib.close_hpi_connection()
+        self.assertEqual(lib.open_hpi_connection('shmm'), 2)
+        self.assertTrue(lib._s is session)
+        self.assertEqual(lib.get_connection_memory_usage().keys(), [2])
+        lib.close_all_hpi_connections()
+        statistics = self.pool.statistics()
+        self.assertEqual((statistics['idle'], statistics['in_use']), (1, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()